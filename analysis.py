@@ -0,0 +1,53 @@
+"""Spectral analysis for music2picture.
+
+All slices of a track are analysed at once: the samples are reshaped into a
+(slices, size) array and transformed with a single batched rfft. Per-slice
+features are reductions along the last axis of the resulting spectrum, so
+adding a feature never needs a python loop over the slices."""
+import numpy as np
+
+
+class SpectrumAnalyzer(object):
+    """Batched FFT over equally sized slices of a signal.
+
+    The band is clipped to the nyquist frequency of the context, so no work
+    is spent on bins that the (decimated) data cannot contain. The window and
+    the frequency axis only depend on the slice size and the context, so
+    they are computed once and reused for every track of that format."""
+
+    def __init__(self, size, context, minFreq=20, maxFreq=20000,
+                 window=None):
+        self.size = size
+        self.context = context
+        df = context.rate / size
+        self.lo = int(minFreq / df)
+        self.hi = min(int(maxFreq / df), size // 2 + 1)
+        if self.lo >= self.hi:
+            raise ValueError("Empty band: %s-%s Hz at %s" %
+                             (minFreq, maxFreq, context))
+        self.freqs = np.arange(self.lo, self.hi) * df
+        self.window = None if window is None else window(size)
+
+
+    def frames(self, samples, count):
+        """Returns the first count slices of samples as a 2-D array. This is a
+        view whenever samples is a (possibly strided) 1-D view itself."""
+        return samples[:count*self.size].reshape(count, self.size)
+
+
+    def magnitudes(self, frames):
+        """Returns the magnitude spectrum of each row, cut to the band."""
+        if self.window is not None:
+            frames = frames * self.window
+        return abs(np.fft.rfft(frames, axis=-1)[:, self.lo:self.hi])
+
+
+    def peaks(self, frames):
+        """Returns the dominant frequency of each row."""
+        return self.freqs[self.magnitudes(frames).argmax(axis=-1)]
+
+
+def sliceFrequencies(samples, context, count, **kwds):
+    """Splits samples into count slices and returns their peak frequencies."""
+    analyzer = SpectrumAnalyzer(samples.size // count, context, **kwds)
+    return analyzer.peaks(analyzer.frames(samples, count))
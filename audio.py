@@ -0,0 +1,206 @@
+"""Audio sources for music2picture.
+
+The data chunk of a wav file is never read into memory as a whole. It is
+exposed as a numpy memmap, so channel selection and plain decimation are
+strided views over the mapped file and only the samples that are actually
+used get paged in. Band-limited decimation is done by a streaming Decimator
+that works on one block of the file at a time."""
+import os, struct
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+class AudioFormatError(Exception):
+    pass
+
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+_pcm_dtypes = {1: '<u1', 2: '<i2', 4: '<i4'}
+_float_dtypes = {4: '<f4', 8: '<f8'}
+
+
+def readChunks(f):
+    """Yields (id, offset, size) for every chunk in a RIFF/WAVE file. The
+    offset points at the chunk payload, not at its header."""
+    header = f.read(12)
+    if len(header) < 12:
+        raise AudioFormatError("File too short to be a wav file")
+    riff, size, wave = struct.unpack('<4sI4s', header)
+    if riff != 'RIFF' or wave != 'WAVE':
+        raise AudioFormatError("Not a RIFF/WAVE file")
+    offset = 12
+    while True:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        cid, csize = struct.unpack('<4sI', header)
+        yield cid, offset + 8, csize
+        # Chunks are word aligned.
+        offset += 8 + csize + (csize & 1)
+
+
+class AudioContext(object):
+    """Describes the samples flowing through the analysis pipeline.
+
+    The format comes from the wav header and is carried along through every
+    stage that changes it (decimation), so the spectral analysis always
+    knows the real rate of the data it is given."""
+
+    def __init__(self, rate, channels=1, sampwidth=2, decimation=1):
+        self.rate = float(rate)
+        self.channels = channels
+        self.sampwidth = sampwidth
+        self.decimation = decimation
+
+
+    def __repr__(self):
+        return "<AudioContext %g Hz, %d ch, %d bit>" % (
+            self.rate, self.channels, self.sampwidth * 8)
+
+
+    @property
+    def nyquist(self):
+        return self.rate / 2
+
+
+    def decimated(self, factor):
+        """Returns the context of the same data reduced by factor."""
+        return AudioContext(self.rate / factor, self.channels, self.sampwidth,
+                            self.decimation * factor)
+
+
+    def frames(self, seconds):
+        return int(seconds * self.rate)
+
+
+    def seconds(self, frames):
+        return frames / self.rate
+
+
+class WaveSource(object):
+    """Read-only, memory-mapped view over the samples of a wav file."""
+
+    def __init__(self, path):
+        self.path = path
+        fmt = None
+        data = None
+        with open(path, 'rb') as f:
+            for cid, offset, size in readChunks(f):
+                if cid == 'fmt ':
+                    f.seek(offset)
+                    fmt = f.read(size)
+                elif cid == 'data':
+                    data = offset, size
+                    break
+        if fmt is None or data is None:
+            raise AudioFormatError("Missing fmt or data chunk in %s" % path)
+
+        tag, self.channels, self.rate, _, align, bits = \
+             struct.unpack('<HHIIHH', fmt[:16])
+        if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            tag = struct.unpack('<H', fmt[24:26])[0]
+        self.sampwidth = bits // 8
+
+        if tag == WAVE_FORMAT_PCM:
+            dtype = _pcm_dtypes.get(self.sampwidth)
+        elif tag == WAVE_FORMAT_IEEE_FLOAT:
+            dtype = _float_dtypes.get(self.sampwidth)
+        else:
+            raise AudioFormatError("Unsupported wav format tag: %#x" % tag)
+        if dtype is None or align != self.channels * self.sampwidth:
+            raise AudioFormatError("Unsupported sample width: %s bits" % bits)
+
+        self.offset, size = data
+        # Truncated files report a larger data chunk than they contain.
+        size = min(size, os.path.getsize(path) - self.offset)
+        self.nframes = max(size, 0) // align
+        if self.nframes:
+            self.data = np.memmap(path, dtype=dtype, mode='r',
+                                  offset=self.offset,
+                                  shape=(self.nframes, self.channels))
+        else:
+            # Empty files can't be mapped.
+            self.data = np.empty((0, self.channels), dtype)
+
+
+    def __len__(self):
+        return self.nframes
+
+
+    @property
+    def context(self):
+        return AudioContext(self.rate, self.channels, self.sampwidth)
+
+
+    def channel(self, index=0):
+        """Returns a strided view over one channel."""
+        return self.data[:, index]
+
+
+    def decimated(self, factor, channel=0):
+        """Returns every factor-th sample of a channel as a strided view.
+        No filtering is done."""
+        return self.data[0:-1:factor, channel]
+
+
+    def blocks(self, size=1 << 16, channel=0):
+        """Yields consecutive views of a channel, size frames at a time."""
+        samples = self.channel(channel)
+        for start in xrange(0, self.nframes, size):
+            yield samples[start:start+size]
+
+
+def lowpass(ntaps, cutoff):
+    """Windowed-sinc FIR lowpass. cutoff is given as a fraction of the
+    sample rate (0.5 being the nyquist frequency)."""
+    n = np.arange(ntaps) - (ntaps - 1) / 2.
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(ntaps)
+    return taps / taps.sum()
+
+
+class Decimator(object):
+    """Anti-aliased decimation by an integer factor, block by block.
+
+    The filter history and the position of the next output sample are
+    carried over between blocks, so feeding a signal in arbitrary chunks
+    gives the same output as filtering it in one go. Only every factor-th
+    output is computed: each of them is a dot product of the taps with a
+    strided window over the input, which is the polyphase form of the
+    filter."""
+
+    def __init__(self, factor, ntaps=None, cutoff=0.45):
+        self.factor = factor
+        if ntaps is None:
+            ntaps = 8 * factor + 1
+        # Reversed so that a dot product with an input window is a convolution.
+        self.taps = lowpass(ntaps, cutoff / factor)[::-1].copy()
+        self.reset()
+
+
+    def reset(self):
+        self.history = np.zeros(len(self.taps) - 1)
+        self.phase = 0
+
+
+    def process(self, block):
+        """Filters and decimates one block, returning the reduced samples."""
+        ntaps = len(self.taps)
+        x = np.concatenate((self.history, np.asarray(block, dtype=float)))
+        # Row i is the window of input ending at block[i].
+        rows = len(x) - ntaps + 1
+        windows = as_strided(x, shape=(rows, ntaps),
+                             strides=(x.strides[0], x.strides[0]))
+        out = np.dot(windows[self.phase::self.factor], self.taps)
+        self.phase += len(out) * self.factor - rows
+        self.history = x[rows:].copy()
+        return out
+
+
+    def stream(self, blocks):
+        """Generator version of process for an iterable of blocks."""
+        for block in blocks:
+            yield self.process(block)
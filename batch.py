@@ -0,0 +1,113 @@
+"""Batch conversion of whole music collections.
+
+Tracks are converted by a pool of threads. Each thread analyses its track
+and sends the flame to a RenderService, whose worker processes load
+libflam3 once and are replaced if they crash or time out, so a bad track
+only fails itself. The template is loaded here before anything starts.
+Every finished track is recorded as one json line in a results manifest,
+and outputs that are newer than their input are skipped, so an
+interrupted batch can simply be restarted."""
+import os, sys, time, json, traceback
+from multiprocessing.pool import ThreadPool
+
+import music2picture
+from fr0stlib.renderservice import RenderService
+
+
+MUSIC_EXTENSIONS = ('.wav',)
+
+
+def findTracks(path):
+    """Returns the tracks to convert and the directory they are relative to.
+    path is either a directory, which is searched recursively, or a manifest
+    file with one track per line."""
+    if os.path.isdir(path):
+        tracks = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            tracks.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                          if os.path.splitext(name)[1].lower() in MUSIC_EXTENSIONS)
+        return tracks, path
+    with open(path) as f:
+        tracks = [line.strip() for line in f]
+    root = os.path.dirname(os.path.abspath(path))
+    return [os.path.join(root, t) for t in tracks if t and not t.startswith('#')], root
+
+
+def outputPath(track, inputRoot, outputRoot, ext):
+    """Mirrors the location of track below inputRoot into outputRoot."""
+    rel = os.path.relpath(os.path.abspath(track), os.path.abspath(inputRoot))
+    if rel.startswith(os.pardir):
+        # Tracks from outside the root (manifest with absolute paths).
+        rel = os.path.basename(track)
+    return os.path.join(outputRoot, os.path.splitext(rel)[0] + ext)
+
+
+def isUpToDate(track, output):
+    return (os.path.exists(output) and
+            os.path.getmtime(output) >= os.path.getmtime(track))
+
+
+def _convert(service, settings, (track, output)):
+    start = time.time()
+    result = dict(input=track, output=output)
+    try:
+        music2picture.convert(track, output, service=service, **settings)
+    except Exception as e:
+        result.update(status='failed', error="%s: %s" % (type(e).__name__, e),
+                      traceback=traceback.format_exc())
+    else:
+        result['status'] = 'ok'
+    result['seconds'] = time.time() - start
+    return result
+
+
+def runBatch(inputPath, outputRoot, templatePath=None, size=(640,480),
+             quality=500, sliceNum=256, useCache=True, processes=None,
+             ext='.jpg', resultsPath=None, renderer='flam3', timeout=None):
+    """Converts every track found at inputPath. Returns the number of
+    failures. renderer and timeout are passed on to the RenderService.
+    Raises right away if the template can't be loaded."""
+    if templatePath is None:
+        templatePath = music2picture.defaultTemplatePath()
+    music2picture.templateFlame(templatePath)
+    if resultsPath is None:
+        resultsPath = os.path.join(outputRoot, 'results.jsonl')
+    if not os.path.exists(outputRoot):
+        os.makedirs(outputRoot)
+
+    tracks, inputRoot = findTracks(inputPath)
+    jobs = []
+    skipped = []
+    for track in tracks:
+        output = outputPath(track, inputRoot, outputRoot, ext)
+        if isUpToDate(track, output):
+            skipped.append(dict(input=track, output=output, status='skipped',
+                                seconds=0.0))
+        else:
+            jobs.append((track, output))
+
+    settings = dict(templatePath=templatePath, size=tuple(size),
+                    quality=quality, sliceNum=sliceNum,
+                    cache=music2picture.defaultCache() if useCache else None)
+    failed = 0
+    # Results are appended and flushed one by one, so the manifest of an
+    # interrupted batch is still complete up to the point of interruption.
+    with open(resultsPath, 'a') as manifest:
+        for result in skipped:
+            manifest.write(json.dumps(result) + '\n')
+        service = RenderService(processes or 0, renderer, timeout, size)
+        pool = ThreadPool(service.processes)
+        try:
+            for result in pool.imap_unordered(
+                    lambda job: _convert(service, settings, job), jobs):
+                if result['status'] == 'failed':
+                    failed += 1
+                    print >>sys.stderr, "%s: %s" % (result['input'], result['error'])
+                manifest.write(json.dumps(result) + '\n')
+                manifest.flush()
+        finally:
+            pool.terminate()
+            pool.join()
+            service.close()
+    return failed
@@ -0,0 +1,150 @@
+"""Content-addressed on-disk cache for audio analysis results.
+
+Results are keyed by a hash of the wav data chunk plus the analysis
+parameters, so renaming or re-tagging a file doesn't invalidate them. To
+avoid hashing the audio on every run, a small reference file maps the
+path, size and mtime of a track to its content hash. A repeat analysis of
+an unchanged file therefore never opens the file at all.
+
+Entries are stored as .npy files. The directory is kept under a size limit
+by deleting the least recently used entries (a hit touches the mtime). The
+size is kept as a running total of what this process wrote, so the
+directory is only scanned when that goes over the limit (and once on the
+first write). Entries written by other processes meanwhile are counted at
+the next scan."""
+import os, hashlib, threading
+import numpy as np
+
+from audio import WaveSource
+
+
+FORMAT_VERSION = 1
+# Eviction frees space down to this fraction of maxBytes, so a full cache
+# isn't scanned again on the very next put.
+EVICT_TARGET = 0.8
+
+
+class AnalysisCache(object):
+    def __init__(self, directory, maxBytes=64 << 20):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self._size = None
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+
+    def _path(self, name, ext):
+        return os.path.join(self.directory, name + ext)
+
+
+    def contentHash(self, path, blocksize=1 << 16):
+        """Returns the md5 of the data chunk of a wav file, using the stat
+        reference when the file is unchanged since it was last hashed."""
+        st = os.stat(path)
+        # repr keeps the sub-second part of the mtime, str doesn't.
+        ref = hashlib.md5("%s|%s|%r" % (os.path.abspath(path), st.st_size,
+                                        st.st_mtime)).hexdigest()
+        refpath = self._path(ref, '.ref')
+        try:
+            os.utime(refpath, None)
+            with open(refpath) as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            # Not hashed yet, or just evicted by another process.
+            pass
+
+        source = WaveSource(path)
+        h = hashlib.md5()
+        for start in xrange(0, source.nframes, blocksize):
+            h.update(np.ascontiguousarray(source.data[start:start+blocksize]))
+        digest = h.hexdigest()
+        self._added(self._write(refpath, lambda f: f.write(digest)))
+        return digest
+
+
+    def key(self, path, **params):
+        """Returns the cache key for the analysis of path with params."""
+        params['version'] = FORMAT_VERSION
+        return hashlib.md5(self.contentHash(path) +
+                           repr(sorted(params.items()))).hexdigest()
+
+
+    def get(self, key):
+        path = self._path(key, '.npy')
+        try:
+            os.utime(path, None)
+            return np.load(path)
+        except (IOError, OSError):
+            # Not cached, or just evicted by another process.
+            return None
+
+
+    def put(self, key, value):
+        self._added(self._write(self._path(key, '.npy'),
+                                lambda f: np.save(f, np.asarray(value))))
+
+
+    def _added(self, nbytes):
+        if self._size is not None:
+            self._size += nbytes
+            if self._size <= self.maxBytes:
+                return
+        self.evict()
+
+
+    def evict(self):
+        """Deletes least recently used entries if the directory is over
+        maxBytes. This scans the whole directory; put calls it only when
+        needed."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(('.npy', '.ref')):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                # Evicted by another process meanwhile.
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        target = self.maxBytes * EVICT_TARGET if total > self.maxBytes \
+                 else self.maxBytes
+        for mtime, size, name in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+
+
+    def _write(self, path, writer):
+        """Writes path and returns its size."""
+        # Write to a temporary name first so a crash never leaves a
+        # truncated entry behind.
+        tmp = "%s.%s.%s.tmp" % (path, os.getpid(),
+                                threading.current_thread().ident)
+        with open(tmp, 'wb') as f:
+            writer(f)
+        size = os.path.getsize(tmp)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Windows can't rename over an existing file. The entry is
+            # content-addressed, so the existing one is just as good.
+            os.remove(tmp)
+            return 0
+        return size
+
+
+    def lookup(self, path, compute, **params):
+        """Returns the cached result for path and params, calling compute()
+        and storing its result on a miss."""
+        key = self.key(path, **params)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
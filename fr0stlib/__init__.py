@@ -29,6 +29,8 @@ from fr0stlib.pyflam3 import Genome, RandomContext, flam3_nvariations, \
   variable_list, variation_list, variations, variables, flam3_estimate_bounding_box
 from fr0stlib.compatibility import compatibilize
 from fr0stlib.property_array import property_array
+from fr0stlib.interpolation import curve_factor
+from fr0stlib.flameindex import FlameIndex, JOURNAL_EXT
 
 
 VERSION = "Fr0st 1.4"
@@ -111,6 +113,19 @@ class Flame(object):
         return self
 
 
+    def from_bytes(self, data):
+        """Binary counterpart of from_element. See fr0stlib.flamebin."""
+        from fr0stlib.flamebin import loads
+        return loads(data, self)
+
+
+    def to_bytes(self):
+        """Returns a compact binary encoding of the flame, which is faster
+        to produce and to read back than to_string. See fr0stlib.flamebin."""
+        from fr0stlib.flamebin import dumps
+        return dumps(self)
+
+
     def to_string(self, omit_details=False):
         """Extracts parameters from a Flame object and converts them into
         string format."""
@@ -151,16 +166,21 @@ class Flame(object):
     def add_final(self, **kwds):
         if self.final:
             return self.final
-        defaults = dict(coefs=(1.0, 0.0, 0.0, 1.0, 0.0, 0.0),
-                        linear=1, color=0, color_speed=0, animate=0)
+        defaults = dict(linear=1, color=0, color_speed=0, animate=0)
+        if "screen_coefs" not in kwds:
+            defaults["coefs"] = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
         defaults.update(kwds)
         self.final = Xform(self, **defaults)
         return self.final
 
 
     def add_xform(self, **kwds):
-        defaults = dict(coefs=(1.0, 0.0, 0.0, 1.0, 0.0, 0.0),
-                        linear=1, color=0, weight=1)
+        """Appends a new xform. Any xform attribute can be passed as a
+        keyword, including coefs or screen_coefs (the order used in flame
+        files), so a whole xform can be built from a single spec dict."""
+        defaults = dict(linear=1, color=0, weight=1)
+        if "screen_coefs" not in kwds:
+            defaults["coefs"] = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
         defaults.update(kwds)
         self.xform.append(Xform(self, **defaults))
         return self.xform[-1]
@@ -171,7 +191,18 @@ class Flame(object):
         self.final = None
         
     def copy(self):
-        return Flame(string=self.to_string())
+        """Returns an independent copy of the flame. Unlike a round trip
+        through to_string, nothing is serialized or parsed."""
+        flame = Flame.__new__(Flame)
+        flame.__dict__.update((k, _copy_value(v))
+                              for k, v in self.__dict__.iteritems())
+        flame.gradient = self.gradient.copy()
+        xforms = dict((x, x._clone(flame)) for x in self.iter_xforms())
+        flame.xform = [xforms[x] for x in self.xform]
+        flame.final = xforms[self.final] if self.final else None
+        for old, new in xforms.iteritems():
+            new.chaos = old.chaos._clone(new, xforms)
+        return flame
 
 
     def iter_xforms(self):
@@ -224,6 +255,75 @@ class Flame(object):
         else:
             self.scale = tmpscale
             
+    @property_array
+    def coefs(self):
+        """The coefs of all xforms (final last), stacked into an (n, 6)
+        array. Rows are in the same order as Xform.coefs."""
+        return self._stack_coefs(self.iter_xforms())
+    @coefs.setter
+    def coefs(self, v):
+        self._unstack_coefs(self.iter_xforms(), v)
+
+
+    @property_array
+    def post_coefs(self):
+        """Same as coefs, for the post transforms."""
+        return self._stack_coefs(x.post for x in self.iter_xforms())
+    @post_coefs.setter
+    def post_coefs(self, v):
+        self._unstack_coefs((x.post for x in self.iter_xforms()), v)
+
+
+    def _stack_coefs(self, xforms):
+        return numpy.array([x._coefs for x in xforms]
+                           ).reshape(-1, 6)[:, (0, 3, 1, 4, 2, 5)]
+
+    def _unstack_coefs(self, xforms, v):
+        v = numpy.asarray(v, dtype=float).reshape(-1, 6)[:, (0, 2, 4, 1, 3, 5)]
+        xforms = list(xforms)
+        if len(xforms) != len(v):
+            raise ValueError("Expected coefs for %s xforms" % len(xforms))
+        for x, row in zip(xforms, v):
+            x._coefs[:] = row
+
+
+    def _transform_xforms(self, linear, offset=None, post=False):
+        coefs = self.post_coefs if post else self.coefs
+        with coefs.batch():
+            points = coefs.reshape(-1, 3, 2)
+            points[:, :2] = points[:, :2].dot(linear)
+            if offset is not None:
+                points[:, 2] = points[:, 2].dot(linear) + offset
+
+
+    def transform_xforms(self, matrix, post=False):
+        """Applies the 2x3 affine matrix [[a, b, tx], [c, d, ty]] to all
+        xforms (or their posts) at once. The x and y axes of each xform are
+        mapped by the linear part, its origin by the whole matrix."""
+        matrix = numpy.asarray(matrix, dtype=float)
+        self._transform_xforms(matrix[:, :2].T, matrix[:, 2], post)
+
+
+    def rotate_xforms(self, deg, pivot=None, post=False):
+        """Same as calling Xform.rotate on every xform."""
+        rot = _rotation(deg)
+        offset = None
+        if pivot is not None:
+            pivot = numpy.asarray(pivot, dtype=float)
+            offset = pivot - pivot.dot(rot)
+        self._transform_xforms(rot, offset, post)
+
+
+    def scale_xforms(self, v, post=False):
+        """Same as calling Xform.scale on every xform."""
+        self._transform_xforms(numpy.eye(2) * v, None, post)
+
+
+    def translate_xforms(self, v, post=False):
+        """Moves the origin of every xform by v."""
+        self._transform_xforms(numpy.eye(2), v, post)
+
+            
     def add_symmetry(self,sym):
         """Adds xforms as per symmetry tag - sym=0 chooses random symmetry"""
         if sym==0:
@@ -244,6 +344,7 @@ class Flame(object):
         
         srot = 360.0 / float(sym)
         
+        start = len(self.xform)
         for k in range(1,sym):
             x = self.add_xform()
             x.weight = 1.0
@@ -253,8 +354,12 @@ class Flame(object):
                 x.color = 0.0
             else:
                 x.color = (k-1.0)/(sym-2.0)
-            
-            x.rotate(k*srot)
+
+        # The new xforms are all identities, so rotating them by k*srot
+        # means setting their axes to the rows of the rotation matrices.
+        with self.coefs.batch() as coefs:
+            points = coefs.reshape(-1, 3, 2)
+            points[start:start+sym-1, :2] = _rotation(numpy.arange(1, sym)*srot)
 
     def move_center(self, diff):
         """Moves center point, adjusting for any flame rotation."""
@@ -311,6 +416,12 @@ class Palette(object):
         return iter(self.data)
 
 
+    def copy(self):
+        palette = Palette()
+        palette.data = self.data.copy()
+        return palette
+
+
     def to_string(self):
         return ''.join(['   <color index="%s" rgb="%s %s %s"/>\n' %
                         (idx,
@@ -340,13 +451,25 @@ class Palette(object):
             # parse flam3-style palette (list of <color> elements)
             data = [map(float, color.get('rgb').split())
                     for color in flame.findall('color')]
+            if not data:
+                # No palette at all (e.g. a template). Keep the current one.
+                return
             
         if len(data) != 256:
             raise ParsingError('Wrong number of palette entries specified: '
-                               '%s != %s' % (256, len(lst)))
+                               '%s != %s' % (256, len(data)))
         self.data[:] = data
 
 
+    def from_array(self, data):
+        """Sets all entries at once from a (256, 3) array of rgb values."""
+        data = numpy.asarray(data)
+        if data.shape != (256, 3):
+            raise ValueError("Palette data must have shape (256, 3), not %s"
+                             % (data.shape,))
+        self.data = numpy.array(data, dtype=numpy.uint8)
+
+
     def reverse(self):
         self.data = numpy.array(self.data[::-1], dtype=numpy.uint8)
 
@@ -357,28 +480,21 @@ class Palette(object):
 
 
     def hue(self, value):
-        value = value/360.0
-        for i in xrange(256):
-            h,l,s = rgb2hls(self.data[i])
-            h = (h + value) % 1
-            rgb = hls2rgb((h,l,s))
-            self.data[i] = hls2rgb((h,l,s))
+        hls = rgb2hls_array(self.data)
+        hls[:, 0] = (hls[:, 0] + value/360.0) % 1
+        self.data = hls2rgb_array(hls)
 
             
     def saturation(self, value):
-        value = value/100.0
-        for i in xrange(256):
-            h,l,s = rgb2hls(self.data[i])
-            s = max(0, min(1, s + value))
-            self.data[i] = hls2rgb((h,l,s))
+        hls = rgb2hls_array(self.data)
+        hls[:, 2] = numpy.clip(hls[:, 2] + value/100.0, 0, 1)
+        self.data = hls2rgb_array(hls)
 
             
     def brightness(self, value):
-        value = value/100.0
-        for i in xrange(256):
-            h,l,s = rgb2hls(self.data[i])
-            l = max(0, min(1, l + value))
-            self.data[i] = hls2rgb((h,l,s))
+        hls = rgb2hls_array(self.data)
+        hls[:, 1] = numpy.clip(hls[:, 1] + value/100.0, 0, 1)
+        self.data = hls2rgb_array(hls)
 
             
     def invert(self):
@@ -386,17 +502,7 @@ class Palette(object):
 
 
     def from_seeds(self, seeds, curve='cos'):
-        ns = len(seeds)
-        d = 256/ns
-        r = 256%ns
-        gen = []
-        for i in xrange(ns):
-            ds = d + (i < r)
-            start, end = seeds[i-1], seeds[i]
-            for j in xrange(ds):
-                hsv = pblend_color(start, end, j/float(ds), curve)
-                gen.append(hsv2rgb(hsv))
-        self.data = numpy.array(gen, dtype=numpy.uint8)
+        self.data = gradients_from_seeds([seeds], curve)[0]
 
 
     def random(self, hue=(0,1), saturation=(0,1), value=(0,1),  nodes=(5,5),
@@ -410,8 +516,107 @@ class Palette(object):
         self.from_seeds(seeds, curve)
 
 
+def gradients_from_seeds(seeds, curve='cos'):
+    """Array version of Palette.from_seeds. seeds has shape (n, nodes, 3),
+    holding n sets of hsv nodes; returns an (n, 256, 3) array of palettes.
+
+    Each palette is split into one segment per node, blending from the
+    previous node to the current one like pblend_color does."""
+    seeds = numpy.asarray(seeds, dtype=numpy.float64)
+    ns = seeds.shape[1]
+    d, r = divmod(256, ns)
+    lengths = [d + (i < r) for i in xrange(ns)]
+    segment = numpy.repeat(numpy.arange(ns), lengths)
+    i = numpy.concatenate([numpy.arange(ds) / float(ds) for ds in lengths])
+
+    start = seeds[:, segment-1].copy()
+    end = seeds[:, segment].copy()
+    # Wrap hue around 1.0 if necessary
+    h1, h2 = start[..., 0], end[..., 0]
+    wrap1 = h1 < h2 - .5
+    wrap2 = ~wrap1 & (h2 < h1 - .5)
+    h1[wrap1] += 1
+    h2[wrap2] += 1
+
+    t = curve_factor(i, curve)[:, None]
+    return hsv2rgb_array(start + ((end-start) * t))
+
+
+def random_gradients(n, hue=(0,1), saturation=(0,1), value=(0,1),
+                     nodes=(5,5), curve='cos', rand=numpy.random):
+    """Array version of Palette.random. Returns an (n, 256, 3) array of
+    random palettes."""
+    h1, h2 = hue
+    if h1 > h2:
+        hue = h1, h2 + 1
+    low, high = zip(hue, saturation, value)
+    counts = rand.uniform(nodes[0], nodes[1], n).astype(int)
+    result = numpy.empty((n, 256, 3), dtype=numpy.uint8)
+    # Palettes are generated in one go per distinct number of nodes.
+    for count in numpy.unique(counts):
+        index = numpy.flatnonzero(counts == count)
+        seeds = rand.uniform(low, high, (len(index), count, 3))
+        result[index] = gradients_from_seeds(seeds, curve)
+    return result
+
+
+class _ArrayAttribute(object):
+    """Exposes one element of a float array of an Xform as an attribute.
+
+    NaN marks an element as not set. Reading it returns default, or raises
+    AttributeError if there is none. The array itself is only allocated on
+    the first assignment."""
+    __slots__ = ('array', 'index', 'size', 'default')
+
+    def __init__(self, array, index, size, default=None):
+        self.array = array
+        self.index = index
+        self.size = size
+        self.default = default
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        arr = getattr(obj, self.array)
+        if arr is not None:
+            v = arr.item(self.index)
+            if v == v:
+                return v
+        if self.default is None:
+            raise AttributeError
+        return self.default
+
+    def __set__(self, obj, v):
+        arr = getattr(obj, self.array)
+        if arr is None:
+            arr = numpy.empty(self.size)
+            arr.fill(numpy.nan)
+            setattr(obj, self.array, arr)
+        arr[self.index] = v
+
+    def __delete__(self, obj):
+        arr = getattr(obj, self.array)
+        if arr is None or arr.item(self.index) != arr.item(self.index):
+            raise AttributeError
+        arr[self.index] = numpy.nan
+
+
 class Xform(object):
-    """Container for transform parameters."""
+    """Container for transform parameters.
+
+    The affine coefs, variation weights and variation parameters are kept
+    in float arrays (_coefs, _vars and _params), laid out like "abcdef",
+    variation_list and variable_list respectively. They are accessed
+    through class level attributes with the usual names. The other
+    attributes flam3 knows have slots of their own, and any unknown ones
+    are kept in the _extra dict."""
+    __slots__ = ('_parent', 'chaos', 'post', '_coefs', '_vars', '_params',
+                 'opacity', 'color', 'color_speed', 'animate', 'weight',
+                 'symmetry', '_extra', '__weakref__')
+
+    # The slots above holding xml attributes, in the order they're written.
+    _scalars = ('opacity', 'color', 'color_speed', 'animate', 'weight',
+                'symmetry')
 
     # Control behavoir of certain attributes:
     # _always_write: is written to disk even if set at 0
@@ -427,6 +632,10 @@ class Xform(object):
 
     def __init__(self, parent, chaos=(), post=(1.,0.,0.,1.,0.,0.), **kwds):
         self._parent = parent
+        self._coefs = numpy.zeros(6)
+        self._vars = None
+        self._params = None
+        self._extra = None
            
         if not isinstance(self, PostXform):
             self.opacity = 1.0
@@ -549,9 +758,31 @@ class Xform(object):
         # only called when it fails.
         if v in self._default:
             return 0.0
+        if v != '_extra':
+            extra = self._extra
+            if extra and v in extra:
+                return extra[v]
         raise AttributeError(v)
 
 
+    def __setattr__(self, name, v):
+        if hasattr(type(self), name):
+            # A slot, property or array attribute.
+            object.__setattr__(self, name, v)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[name] = v
+
+
+    def __delattr__(self, name):
+        extra = self._extra
+        if extra and name in extra:
+            del extra[name]
+        else:
+            object.__delattr__(self, name)
+
+
     @property
     def index(self):
         if self.isfinal():
@@ -564,30 +795,56 @@ class Xform(object):
         
     @property_array
     def coefs(self):
-        return self.a,self.d,self.b,self.e,self.c,self.f
+        a,b,c,d,e,f = self._coefs.tolist()
+        return a,d,b,e,c,f
     @coefs.setter
     def coefs(self,v):
-        self.a,self.d,self.b,self.e,self.c,self.f = v
+        a,d,b,e,c,f = v
+        self._coefs[:] = a,b,c,d,e,f
 
        
     @property_array
     def screen_coefs(self):
-        return self.a,-self.d,-self.b,self.e,self.c,-self.f
+        a,b,c,d,e,f = self._coefs.tolist()
+        return a,-d,-b,e,c,-f
     @screen_coefs.setter
     def screen_coefs(self, v):
         self.coefs = v
-        self.d = -self.d
-        self.b = -self.b
-        self.f = -self.f
+        self._coefs[1::2] *= -1
 
 
     def list_variations(self):
-        return [i for i in variation_list if i in self.__dict__]
+        if self._vars is None:
+            return []
+        return [variation_list[i]
+                for i in (self._vars == self._vars).nonzero()[0]]
+
+
+    def _iter_scalars(self):
+        """Yields the attributes that aren't kept in arrays, i.e. the ones
+        in _scalars that are set and the unknown ones."""
+        for k in self._scalars:
+            try:
+                yield k, object.__getattribute__(self, k)
+            except AttributeError:
+                pass
+        if self._extra:
+            for item in self._extra.iteritems():
+                yield item
 
 
     def _iter_attributes(self):
-        return ((k,v) for (k,v) in self.__dict__.iteritems()
-                if k not in self._never_write and v or k in self._always_write)
+        for k, v in self._iter_scalars():
+            if k not in self._never_write and v or k in self._always_write:
+                yield k, v
+        if self._vars is not None:
+            vs = self._vars
+            for i in ((vs != 0) & (vs == vs)).nonzero()[0]:
+                yield variation_list[i], vs.item(i)
+        if self._params is not None:
+            ps = self._params
+            for i in (ps == ps).nonzero()[0]:
+                yield variable_list[i][0], ps.item(i)
 
 #----------------------------------------------------------------------
 
@@ -711,39 +968,44 @@ class Xform(object):
         self.e *= v
         
     def scale(self,v):
-        self.a *= v
-        self.d *= v
-        self.b *= v
-        self.e *= v
+        with self.coefs.batch() as coefs:
+            coefs[:4] *= v
 
         
     def rotate_x(self, deg):
-        self.xp += (0, deg)
+        with self.coefs.batch() as coefs:
+            coefs[:2] = coefs[:2].dot(_rotation(deg))
         
     def rotate_y(self, deg):
-        self.yp += (0, deg)
+        with self.coefs.batch() as coefs:
+            coefs[2:4] = coefs[2:4].dot(_rotation(deg))
 
     def rotate(self, deg, pivot=None):
-        self.rotate_x(deg)
-        self.rotate_y(deg)
-        if pivot is not None:
-            self.orbit(deg, pivot)
+        rot = _rotation(deg)
+        with self.coefs.batch() as coefs:
+            points = coefs.reshape(3, 2)
+            points[:2] = points[:2].dot(rot)
+            if pivot is not None:
+                points[2] = (points[2] - pivot).dot(rot) + pivot
             
         
     # TODO: this function looks useless and unused
     def move(self, v):
-        self.op = (self.op[0] + v, self.op[1])
-        #self.op += (v, 0)
+        """Moves the origin of the transform by v, away from (0, 0)."""
+        with self.coefs.batch() as coefs:
+            o = coefs[4:]
+            r = hypot(*o)
+            if r:
+                o *= (r + v) / r
+            else:
+                o[:] = v, 0
 
 
     def orbit(self, deg, pivot=(0, 0)):
         """Orbits the transform around a fixed point without rotating it."""
-        if pivot == (0, 0):
-            self.op += (0, deg)
-        else:
-            self.pos -= pivot
-            self.op += (0, deg)
-            self.pos += pivot
+        with self.coefs.batch() as coefs:
+            o = coefs[4:]
+            o[:] = (o - pivot).dot(_rotation(deg)) + pivot
 
 #----------------------------------------------------------------------
 
@@ -763,6 +1025,29 @@ class Xform(object):
         return xf
 
 
+    def _clone(self, parent):
+        """Copies the xform (and its post) into parent without touching its
+        chaos, which can only be remapped once all xforms are copied."""
+        xf = object.__new__(type(self))
+        xf._parent = parent
+        xf._coefs = self._coefs.copy()
+        xf._vars = _copy_value(self._vars)
+        xf._params = _copy_value(self._params)
+        xf._extra = None
+        if not isinstance(self, PostXform):
+            for k in self._scalars:
+                try:
+                    v = object.__getattribute__(self, k)
+                except AttributeError:
+                    continue
+                object.__setattr__(xf, k, _copy_value(v))
+            if self._extra:
+                xf._extra = dict((k, _copy_value(v))
+                                 for k, v in self._extra.iteritems())
+            xf.post = self.post._clone(xf)
+        return xf
+
+
     def delete(self):
         if self.isfinal():
             self._parent.final = None            
@@ -771,8 +1056,22 @@ class Xform(object):
 
 
 
+def _add_array_attributes(cls):
+    for i, name in enumerate("abcdef"):
+        setattr(cls, name, _ArrayAttribute('_coefs', i, 6, 0.0))
+    for i, name in enumerate(variation_list):
+        setattr(cls, name, _ArrayAttribute('_vars', i, flam3_nvariations, 0.0))
+    for i, (name, _, _, _) in enumerate(variable_list):
+        setattr(cls, name, _ArrayAttribute('_params', i, len(variable_list)))
+
+_add_array_attributes(Xform)
+
+
+
 class PostXform(Xform):
+    __slots__ = ()
     _allowed = set(('coefs', 'points', 'polars', 'screen_coefs', '_parent',
+                '_coefs', '_vars', '_params', '_extra',
                 'a','b','c','d','e','f',
                 'x','y','o','pos',
                 'xp','yp','op'))
@@ -855,6 +1154,14 @@ class Chaos(object):
             return
         self._dict[self._parent._parent.xform[pos]] = val
 
+    def _clone(self, parent, xforms):
+        """Copies the chaos values to parent, translating the xforms they
+        refer to through the xforms dict."""
+        chaos = Chaos(parent)
+        chaos._dict.update((xforms[k], v) for k, v in self._dict.iteritems()
+                           if k in xforms)
+        return chaos
+
     def to_string(self):
         lst = list(self)
         for i in reversed(lst):
@@ -865,8 +1172,35 @@ class Chaos(object):
 
 
 
-def save_flames(path, *flames):
+def _copy_value(v):
+    """Copies mutable attribute values (lists, arrays), so copied objects
+    don't share them."""
+    if isinstance(v, list):
+        return list(v)
+    if isinstance(v, numpy.ndarray):
+        return v.copy()
+    return v
+
+
+# Journals smaller than this are never compacted.
+JOURNAL_MIN_SIZE = 1 << 20
+
+def save_flames(path, *flames, **kwds):
+    """Writes flames (objects or strings) to path.
+
+    With incremental=True, an existing file is left as it is and only the
+    flames that changed are appended to its journal (see
+    fr0stlib.flameindex). Once the journal grows past half the size of
+    the file, it is folded back in with compact_flames."""
+    incremental = kwds.pop('incremental', False)
+    if kwds:
+        raise TypeError('Got unexpected keyword argument: %s' % tuple(kwds)[0])
     lst = [f.to_string() if isinstance(f, Flame) else f for f in flames]
+    if incremental and os.path.exists(path):
+        size = FlameIndex(path).update(lst)
+        if size > max(os.path.getsize(path) // 2, JOURNAL_MIN_SIZE):
+            compact_flames(path)
+        return
     head, ext = os.path.splitext(path)
     if os.path.exists(path) and ext == ".flame":
         shutil.copy(path, head + ".bak")
@@ -874,24 +1208,104 @@ def save_flames(path, *flames):
     if dirname and not os.path.exists(dirname):
         os.makedirs(dirname)
     with open(path, "w") as f:
-        f.write("""<flames version="%s">\n""" %VERSION)
-        f.write("\n".join(lst))
-        f.write("""</flames>""")
+        _write_flames(f, lst)
+    if os.path.exists(path + JOURNAL_EXT):
+        os.remove(path + JOURNAL_EXT)
+
+
+def _write_flames(f, lst):
+    f.write("""<flames version="%s">\n""" %VERSION)
+    for i, s in enumerate(lst):
+        if i:
+            f.write("\n")
+        f.write(s)
+    f.write("""</flames>""")
+
+
+def compact_flames(path):
+    """Folds the journal left by incremental saves back into the flame file.
+    The new file is written under a temporary name and renamed over the old
+    one, which is kept as .bak like in save_flames."""
+    if not os.path.exists(path):
+        return
+    index = FlameIndex(path)
+    if not index.journaled:
+        index.discard_journal()
+        return
+    tmp = "%s.%s.tmp" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        _write_flames(f, index.iter_strings())
+        f.flush()
+        os.fsync(f.fileno())
+    head, ext = os.path.splitext(path)
+    backup = head + ".bak" if ext == ".flame" else None
+    if backup and os.path.exists(backup):
+        os.remove(backup)
+    if os.name == 'nt':
+        # Windows can't rename over an existing file.
+        if backup:
+            os.rename(path, backup)
+        else:
+            os.remove(path)
+    elif backup:
+        try:
+            os.link(path, backup)
+        except OSError:
+            # No hard links on this filesystem.
+            shutil.copy(path, backup)
+    os.rename(tmp, path)
+    index.discard_journal()
 
 
 def split_flamestrings(string):
     return re.findall(r'<flame .*?</flame>', string, re.DOTALL)
 
 
-def load_flamestrings(filename):
-    """Reads a flame file and returns a list of flame strings."""
-    return split_flamestrings(open(filename).read())
+def load_flamestrings(filename, indices=None):
+    """Reads a flame file and returns a list of flame strings. indices
+    selects flames by position or name; only those are read from the file,
+    through its offset index (see fr0stlib.flameindex)."""
+    return FlameIndex(filename).strings(indices)
 
 
-def load_flames(filename):
-    """Reads a flame file and returns a list of flame objects."""
-    tree = etree.parse(open(filename))
-    return [Flame().from_element(e) for e in tree.findall('flame')]
+def load_flames(filename, indices=None):
+    """Reads a flame file and returns a list of flame objects. indices
+    works as in load_flamestrings."""
+    if indices is None:
+        return list(iter_flames(filename))
+    return [Flame(s) for s in load_flamestrings(filename, indices)]
+
+
+def iter_flames(filename, predicate=None):
+    """Parses a flame file incrementally, yielding one flame object at a
+    time. Each element is discarded once it has been converted, so memory
+    use doesn't grow with the size of the file.
+
+    predicate, if given, is called with the xml element of each flame, and
+    only flames for which it returns true are built. For example:
+
+    iter_flames(path, lambda e: e.get('name').startswith('spiral'))"""
+    if os.path.exists(filename + JOURNAL_EXT):
+        index = FlameIndex(filename)
+        if index.journaled:
+            for string in index.iter_strings():
+                element = etree.fromstring(string)
+                if predicate is None or predicate(element):
+                    yield Flame().from_element(element)
+            return
+    context = etree.iterparse(filename, events=('start', 'end'))
+    _, root = next(context)
+    depth = 0
+    for event, element in context:
+        if event == 'start':
+            depth += 1
+            continue
+        if depth == 1:
+            if element.tag == 'flame' and (predicate is None
+                                           or predicate(element)):
+                yield Flame().from_element(element)
+            root.clear()
+        depth -= 1
 
 
 def show_status(s):
@@ -913,6 +1327,20 @@ def polar(coord):
     return l, theta   
 
 
+def _rotation(deg):
+    """Returns the matrix that rotates row vectors (or arrays of them) by deg
+    degrees counterclockwise, as in points.dot(_rotation(deg)). For an array
+    of angles, returns one matrix per angle."""
+    theta = numpy.radians(deg)
+    c, s = numpy.cos(theta), numpy.sin(theta)
+    m = numpy.empty(numpy.shape(theta) + (2, 2))
+    m[..., 0, 0] = c
+    m[..., 0, 1] = s
+    m[..., 1, 0] = -s
+    m[..., 1, 1] = c
+    return m
+
+
 def rect(coord):
     real = coord[0] * cos(coord[1]*pi/180.0)
     imag = coord[0] * sin(coord[1]*pi/180.0)
@@ -937,6 +1365,93 @@ def hsv2rgb((h, s, v)):
     return tuple(int(x*255) for x in colorsys.hsv_to_rgb(h,s,v))
 
 
+# Array versions of the converters above. They take and return arrays whose
+# last axis holds the 3 color components, e.g. Palette.data, and give the
+# same results as the colorsys based functions applied to every color.
+
+def _array_hue(r, g, b, maxc, minc):
+    span = maxc - minc
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rc = (maxc-r) / span
+        gc = (maxc-g) / span
+        bc = (maxc-b) / span
+    h = numpy.where(r == maxc, bc-gc,
+                    numpy.where(g == maxc, 2.0+rc-bc, 4.0+gc-rc))
+    return (h/6.0) % 1.0
+
+
+def _array_rgb(color):
+    """Converts an rgb array (0-255) to floats and splits the channels."""
+    rgb = numpy.asarray(color, dtype=numpy.float64) / 255.
+    return rgb[..., 0], rgb[..., 1], rgb[..., 2], rgb.max(-1), rgb.min(-1)
+
+
+def _array_int(r, g, b):
+    return numpy.trunc(numpy.dstack((r, g, b)).reshape(r.shape + (3,))
+                       * 255).astype(numpy.uint8)
+
+
+def rgb2hls_array(color):
+    """Takes an rgb array (0-255) and returns an hls array (hls is scalar)"""
+    r, g, b, maxc, minc = _array_rgb(color)
+    l = (minc+maxc) / 2.0
+    gray = minc == maxc
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        s = numpy.where(l <= 0.5, (maxc-minc) / (maxc+minc),
+                        (maxc-minc) / (2.0-maxc-minc))
+    h = _array_hue(r, g, b, maxc, minc)
+    h[gray] = s[gray] = 0.0
+    return numpy.dstack((h, l, s)).reshape(h.shape + (3,))
+
+
+def _hls_value(m1, m2, hue):
+    hue = hue % 1.0
+    return numpy.select([hue < 1.0/6.0, hue < 0.5, hue < 2.0/3.0],
+                        [m1 + (m2-m1)*hue*6.0, m2,
+                         m1 + (m2-m1)*(2.0/3.0-hue)*6.0],
+                        m1)
+
+
+def hls2rgb_array(color):
+    """Takes an hls array and returns an rgb array (uint8)"""
+    color = numpy.asarray(color, dtype=numpy.float64)
+    h, l, s = color[..., 0], color[..., 1], color[..., 2]
+    m2 = numpy.where(l <= 0.5, l * (1.0+s), l+s-(l*s))
+    m1 = 2.0*l - m2
+    gray = s == 0.0
+    r = numpy.where(gray, l, _hls_value(m1, m2, h+1.0/3.0))
+    g = numpy.where(gray, l, _hls_value(m1, m2, h))
+    b = numpy.where(gray, l, _hls_value(m1, m2, h-1.0/3.0))
+    return _array_int(r, g, b)
+
+
+def rgb2hsv_array(color):
+    r, g, b, maxc, minc = _array_rgb(color)
+    gray = minc == maxc
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        s = (maxc-minc) / maxc
+    h = _array_hue(r, g, b, maxc, minc)
+    h[gray] = s[gray] = 0.0
+    return numpy.dstack((h, s, maxc)).reshape(h.shape + (3,))
+
+
+def hsv2rgb_array(color):
+    color = numpy.asarray(color, dtype=numpy.float64)
+    h, s, v = color[..., 0], color[..., 1], color[..., 2]
+    i = numpy.trunc(h*6.0)
+    f = (h*6.0) - i
+    p = v * (1.0-s)
+    q = v * (1.0-s*f)
+    t = v * (1.0-s*(1.0-f))
+    i = i.astype(int) % 6
+    gray = s == 0.0
+    choices = [i == n for n in range(5)]
+    r = numpy.select(choices, [v, q, p, p, t], v)
+    g = numpy.select(choices, [t, v, v, q, p], p)
+    b = numpy.select(choices, [p, p, t, v, v], q)
+    return _array_int(*(numpy.where(gray, v, x) for x in (r, g, b)))
+
+
 def pblend(s, e, i, curve='linear'):
     """
     s = starting value
@@ -949,15 +1464,7 @@ def pblend(s, e, i, curve='linear'):
         return e
     if s == e:
         return s
-
-    if curve == 'linear':
-        return s + ((e-s) * i)
-    elif curve == 'cos':
-        return s + ((e-s) * 0.5 * (cos((i+1)*pi)+1))
-    elif curve == 'cubic':
-        return s + ((e-s) * (3*i*i - 2*i*i*i))
-    else:
-        raise ValueError('invalid curve')
+    return s + ((e-s) * curve_factor(i, curve))
 
 
 def pblend_vector(start, end, i, curve='linear'):
@@ -967,16 +1474,7 @@ def pblend_vector(start, end, i, curve='linear'):
         return end
     if start == end:
         return start
-
-    if curve == 'linear':
-        t = i
-    elif curve == 'cos':
-        t = 0.5 * (cos((i+1)*pi)+1)
-    elif curve == 'cubic':
-        t = 3*i*i - 2*i*i*i
-    else:
-        raise ValueError('invalid curve')
-    
+    t = curve_factor(i, curve)
     return [s + ((e-s) * t) for s, e in zip(start, end)]
 
 
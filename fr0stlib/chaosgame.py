@@ -0,0 +1,760 @@
+##############################################################################
+#  Fractal Fr0st - fr0st
+#  https://launchpad.net/fr0st
+#
+#  Copyright (C) 2009 by Vitor Bosshard <algorias@gmail.com>
+#
+#  Fractal Fr0st is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Chaos game renderer written in numpy, for when libflam3 isn't available.
+
+Instead of following one point at a time like flam3, a batch of points is
+iterated together: each iteration picks an xform for every point, and the
+points that picked the same xform are transformed in one go. The formulas
+follow flam3 (affine, variations, post, final xform, color blending and
+log-density tone mapping), but there is no density estimation or spatial
+filtering, so images come out slightly sharper and noisier.
+
+Only the variations in VARIATIONS are supported. Rendering a flame that
+uses any other raises NotImplementedError."""
+import time, math, traceback, numpy, multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+from fr0stlib.pyflam3._flam3 import allocate_output_buffer, \
+     as_output_buffer, output_array
+
+
+EPS = 1e-10
+BATCH_SIZE = 1 << 16
+FUSE = 20
+# Points whose coordinates exceed this are treated as bad values.
+BAD_VALUE = 1e10
+PREFILTER_WHITE = 255.0
+
+# Defaults flam3 uses for variation parameters missing from a flame.
+_param_defaults = dict(blob_low=0.0, blob_high=1.0, blob_waves=1.0,
+                       pdj_a=0.0, pdj_b=0.0, pdj_c=0.0, pdj_d=0.0,
+                       fan2_x=0.0, fan2_y=0.0, rings2_val=0.0,
+                       perspective_angle=0.0, perspective_dist=0.0,
+                       julian_power=1.0, julian_dist=1.0,
+                       juliascope_power=1.0, juliascope_dist=1.0,
+                       pie_slices=6.0, pie_rotation=0.0, pie_thickness=0.5,
+                       ngon_sides=5.0, ngon_power=3.0, ngon_circle=1.0,
+                       ngon_corners=2.0, curl_c1=1.0, curl_c2=0.0,
+                       rectangles_x=1.0, rectangles_y=1.0)
+
+
+class _Points(object):
+    """A group of points being transformed by the same xform. The values
+    flam3 precalculates (sumsq, sqrt, atan etc.) are computed on first
+    use."""
+    def __init__(self, x, y, rand):
+        self.x = x
+        self.y = y
+        self.rand = rand
+        self.n = len(x)
+
+    def random(self):
+        return self.rand.random_sample(self.n)
+
+    def __getattr__(self, name):
+        # Only called for attributes that haven't been computed yet.
+        x, y = self.x, self.y
+        if name == 'sumsq':
+            value = x*x + y*y
+        elif name == 'sqrt':
+            value = numpy.sqrt(self.sumsq)
+        elif name == 'atan':
+            value = numpy.arctan2(x, y)
+        elif name == 'atanyx':
+            value = numpy.arctan2(y, x)
+        elif name == 'sina':
+            value = x / self.sqrt
+        elif name == 'cosa':
+            value = y / self.sqrt
+        else:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+
+
+def _linear(p, xf):
+    return p.x, p.y
+
+def _sinusoidal(p, xf):
+    return numpy.sin(p.x), numpy.sin(p.y)
+
+def _spherical(p, xf):
+    r = 1.0 / (p.sumsq + EPS)
+    return p.x * r, p.y * r
+
+def _swirl(p, xf):
+    s, c = numpy.sin(p.sumsq), numpy.cos(p.sumsq)
+    return p.x*s - p.y*c, p.x*c + p.y*s
+
+def _horseshoe(p, xf):
+    r = 1.0 / (p.sqrt + EPS)
+    return (p.x - p.y) * (p.x + p.y) * r, 2.0 * p.x * p.y * r
+
+def _polar(p, xf):
+    return p.atan / math.pi, p.sqrt - 1.0
+
+def _handkerchief(p, xf):
+    a, r = p.atan, p.sqrt
+    return r * numpy.sin(a + r), r * numpy.cos(a - r)
+
+def _heart(p, xf):
+    r = p.sqrt
+    a = r * p.atan
+    return r * numpy.sin(a), -r * numpy.cos(a)
+
+def _disc(p, xf):
+    a = p.atan / math.pi
+    r = math.pi * p.sqrt
+    return numpy.sin(r) * a, numpy.cos(r) * a
+
+def _spiral(p, xf):
+    r = p.sqrt + EPS
+    r1 = 1.0 / r
+    return (p.cosa + numpy.sin(r)) * r1, (p.sina - numpy.cos(r)) * r1
+
+def _hyperbolic(p, xf):
+    r = p.sqrt + EPS
+    return p.sina / r, p.cosa * r
+
+def _diamond(p, xf):
+    r = p.sqrt
+    return p.sina * numpy.cos(r), p.cosa * numpy.sin(r)
+
+def _ex(p, xf):
+    a, r = p.atan, p.sqrt
+    n0 = numpy.sin(a + r) ** 3
+    n1 = numpy.cos(a - r) ** 3
+    return r * (n0 + n1), r * (n0 - n1)
+
+def _julia(p, xf):
+    a = 0.5 * p.atan + math.pi * (p.random() < 0.5)
+    r = numpy.sqrt(p.sqrt)
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+def _bent(p, xf):
+    return (numpy.where(p.x < 0, 2.0 * p.x, p.x),
+            numpy.where(p.y < 0, 0.5 * p.y, p.y))
+
+def _waves(p, xf):
+    c = xf.coefs
+    return (p.x + c[2] * numpy.sin(p.y / (c[4]*c[4] + EPS)),
+            p.y + c[3] * numpy.sin(p.x / (c[5]*c[5] + EPS)))
+
+def _fisheye(p, xf):
+    r = 2.0 / (p.sqrt + 1.0)
+    return r * p.y, r * p.x
+
+def _popcorn(p, xf):
+    c = xf.coefs
+    return (p.x + c[4] * numpy.sin(numpy.tan(3.0 * p.y)),
+            p.y + c[5] * numpy.sin(numpy.tan(3.0 * p.x)))
+
+def _exponential(p, xf):
+    d = numpy.exp(p.x - 1.0)
+    a = math.pi * p.y
+    return d * numpy.cos(a), d * numpy.sin(a)
+
+def _power(p, xf):
+    r = p.sqrt ** p.sina
+    return r * p.cosa, r * p.sina
+
+def _cosine(p, xf):
+    a = math.pi * p.x
+    return numpy.cos(a) * numpy.cosh(p.y), -numpy.sin(a) * numpy.sinh(p.y)
+
+def _rings(p, xf):
+    dx = xf.coefs[4] ** 2 + EPS
+    r = p.sqrt
+    r = numpy.fmod(r + dx, 2.0 * dx) - dx + r * (1.0 - dx)
+    return r * p.cosa, r * p.sina
+
+def _fan(p, xf):
+    dx = math.pi * (xf.coefs[4] ** 2 + EPS)
+    dy = xf.coefs[5]
+    a = p.atan
+    a = numpy.where(numpy.fmod(a + dy, dx) > dx/2, a - dx/2, a + dx/2)
+    r = p.sqrt
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+def _blob(p, xf):
+    low, high = xf.param('blob_low'), xf.param('blob_high')
+    r = p.sqrt * (low + (high - low) *
+                  (0.5 + 0.5 * numpy.sin(xf.param('blob_waves') * p.atan)))
+    return p.sina * r, p.cosa * r
+
+def _pdj(p, xf):
+    a, b, c, d = (xf.param('pdj_' + i) for i in 'abcd')
+    return (numpy.sin(a * p.y) - numpy.cos(b * p.x),
+            numpy.sin(c * p.x) - numpy.cos(d * p.y))
+
+def _fan2(p, xf):
+    dy = xf.param('fan2_y')
+    dx = math.pi * (xf.param('fan2_x') ** 2 + EPS)
+    a = p.atan
+    t = a + dy - dx * numpy.trunc((a + dy) / dx)
+    a = numpy.where(t > dx/2, a - dx/2, a + dx/2)
+    r = p.sqrt
+    return r * numpy.sin(a), r * numpy.cos(a)
+
+def _rings2(p, xf):
+    dx = xf.param('rings2_val') ** 2 + EPS
+    r = p.sqrt
+    r = r - 2.0 * dx * numpy.trunc((r + dx) / (2.0 * dx)) + r * (1.0 - dx)
+    return r * p.sina, r * p.cosa
+
+def _eyefish(p, xf):
+    r = 2.0 / (p.sqrt + 1.0)
+    return r * p.x, r * p.y
+
+def _bubble(p, xf):
+    r = 1.0 / (0.25 * p.sumsq + 1.0)
+    return r * p.x, r * p.y
+
+def _cylinder(p, xf):
+    return numpy.sin(p.x), p.y
+
+def _perspective(p, xf):
+    angle = xf.param('perspective_angle') * math.pi / 2
+    dist = xf.param('perspective_dist')
+    t = 1.0 / (dist - p.y * math.sin(angle))
+    return dist * p.x * t, dist * math.cos(angle) * p.y * t
+
+def _noise(p, xf):
+    a = 2 * math.pi * p.random()
+    r = p.random()
+    return p.x * r * numpy.cos(a), p.y * r * numpy.sin(a)
+
+def _julian(p, xf, name='julian'):
+    power = xf.param(name + '_power')
+    cn = xf.param(name + '_dist') / power / 2.0
+    t = numpy.trunc(abs(power) * p.random())
+    a = (p.atanyx + 2 * math.pi * t) / power
+    r = p.sumsq ** cn
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+def _juliascope(p, xf):
+    power = xf.param('juliascope_power')
+    cn = xf.param('juliascope_dist') / power / 2.0
+    t = numpy.trunc(abs(power) * p.random())
+    a = numpy.where(t % 2 == 0, p.atanyx, -p.atanyx)
+    a = (2 * math.pi * t + a) / power
+    r = p.sumsq ** cn
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+def _blur(p, xf):
+    a = 2 * math.pi * p.random()
+    r = p.random()
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+def _gaussian_blur(p, xf):
+    a = 2 * math.pi * p.random()
+    r = p.random() + p.random() + p.random() + p.random() - 2.0
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+def _pie(p, xf):
+    slices = xf.param('pie_slices')
+    sl = numpy.trunc(p.random() * slices + 0.5)
+    a = xf.param('pie_rotation') + 2 * math.pi * \
+        (sl + p.random() * xf.param('pie_thickness')) / slices
+    r = p.random()
+    return r * numpy.cos(a), r * numpy.sin(a)
+
+def _ngon(p, xf):
+    r = p.sumsq ** (xf.param('ngon_power') / 2.0)
+    b = 2 * math.pi / xf.param('ngon_sides')
+    phi = p.atanyx - b * numpy.floor(p.atanyx / b)
+    phi = numpy.where(phi > b/2, phi - b, phi)
+    amp = (xf.param('ngon_corners') * (1.0 / (numpy.cos(phi) + EPS) - 1.0)
+           + xf.param('ngon_circle')) / (r + EPS)
+    return p.x * amp, p.y * amp
+
+def _curl(p, xf):
+    c1, c2 = xf.param('curl_c1'), xf.param('curl_c2')
+    x, y = p.x, p.y
+    re = 1.0 + c1 * x + c2 * (x*x - y*y)
+    im = c1 * y + 2.0 * c2 * x * y
+    r = 1.0 / (re*re + im*im)
+    return (x*re + y*im) * r, (y*re - x*im) * r
+
+def _rectangles(p, xf):
+    result = []
+    for v, size in ((p.x, xf.param('rectangles_x')),
+                    (p.y, xf.param('rectangles_y'))):
+        if size == 0:
+            result.append(v)
+        else:
+            result.append((2 * numpy.floor(v / size) + 1) * size - v)
+    return result
+
+def _tangent(p, xf):
+    return numpy.sin(p.x) / numpy.cos(p.y), numpy.tan(p.y)
+
+def _square(p, xf):
+    return p.random() - 0.5, p.random() - 0.5
+
+def _cross(p, xf):
+    s = p.x*p.x - p.y*p.y
+    r = numpy.sqrt(1.0 / (s*s + EPS))
+    return p.x * r, p.y * r
+
+def _butterfly(p, xf):
+    y2 = 2.0 * p.y
+    r = 1.3029400317411197908970256609023 * \
+        numpy.sqrt(numpy.abs(p.y * p.x) / (EPS + p.x*p.x + y2*y2))
+    return r * p.x, r * y2
+
+def _exp(p, xf):
+    e = numpy.exp(p.x)
+    return e * numpy.cos(p.y), e * numpy.sin(p.y)
+
+def _log(p, xf):
+    return 0.5 * numpy.log(p.sumsq), p.atanyx
+
+def _sin(p, xf):
+    return (numpy.sin(p.x) * numpy.cosh(p.y),
+            numpy.cos(p.x) * numpy.sinh(p.y))
+
+def _cos(p, xf):
+    return (numpy.cos(p.x) * numpy.cosh(p.y),
+            -numpy.sin(p.x) * numpy.sinh(p.y))
+
+
+VARIATIONS = dict(linear=_linear, sinusoidal=_sinusoidal,
+                  spherical=_spherical, swirl=_swirl, horseshoe=_horseshoe,
+                  polar=_polar, handkerchief=_handkerchief, heart=_heart,
+                  disc=_disc, spiral=_spiral, hyperbolic=_hyperbolic,
+                  diamond=_diamond, ex=_ex, julia=_julia, bent=_bent,
+                  waves=_waves, fisheye=_fisheye, popcorn=_popcorn,
+                  exponential=_exponential, power=_power, cosine=_cosine,
+                  rings=_rings, fan=_fan, blob=_blob, pdj=_pdj, fan2=_fan2,
+                  rings2=_rings2, eyefish=_eyefish, bubble=_bubble,
+                  cylinder=_cylinder, perspective=_perspective, noise=_noise,
+                  julian=_julian, juliascope=_juliascope, blur=_blur,
+                  gaussian_blur=_gaussian_blur, pie=_pie, ngon=_ngon,
+                  curl=_curl, rectangles=_rectangles, tangent=_tangent,
+                  square=_square, cross=_cross, butterfly=_butterfly,
+                  exp=_exp, log=_log, sin=_sin, cos=_cos)
+
+
+class _Xform(object):
+    """The parameters of an xform, in the form flam3 uses them. coefs are
+    in screen (file) order."""
+    def __init__(self, x):
+        self.coefs = tuple(x.screen_coefs)
+        post = tuple(x.post.screen_coefs)
+        self.post = None if post == (1, 0, 0, 1, 0, 0) else post
+        self.color = x.color
+        self.color_speed = x.color_speed
+        self.opacity = x.opacity
+        self._params = x._params
+        self._xform = x
+        self.variations = []
+        for name in x.list_variations():
+            weight = getattr(x, name)
+            if not weight:
+                continue
+            if name not in VARIATIONS:
+                raise NotImplementedError("The numpy renderer doesn't support "
+                                          "the %s variation." % name)
+            self.variations.append((VARIATIONS[name], weight))
+
+    def param(self, name):
+        try:
+            return getattr(self._xform, name)
+        except AttributeError:
+            return _param_defaults[name]
+
+    def apply(self, x, y, c, rand):
+        """Returns the transformed points and color indices."""
+        s0, s1, s2, s3, s4, s5 = self.coefs
+        p = _Points(s0*x + s2*y + s4, s1*x + s3*y + s5, rand)
+        nx = numpy.zeros(p.n)
+        ny = numpy.zeros(p.n)
+        for func, weight in self.variations:
+            vx, vy = func(p, self)
+            nx += weight * vx
+            ny += weight * vy
+        if self.post is not None:
+            s0, s1, s2, s3, s4, s5 = self.post
+            nx, ny = s0*nx + s2*ny + s4, s1*nx + s3*ny + s5
+        c = self.color_speed * self.color + (1.0 - self.color_speed) * c
+        return nx, ny, c
+
+
+class ChaosGame(object):
+    """Iterates the xforms of a flame over a batch of points at a time and
+    accumulates the results into a histogram."""
+    def __init__(self, flame, seed=None, batch_size=BATCH_SIZE):
+        self.xforms = [_Xform(x) for x in flame.xform]
+        self.final = _Xform(flame.final) if flame.final else None
+        weights = numpy.array([x.weight for x in flame.xform], dtype=float)
+        if not len(weights) or weights.sum() <= 0:
+            raise ValueError("Flame has no xforms with nonzero weight.")
+        # Row i holds the cumulative probabilities of the next xform after
+        # xform i, the last row is for the first iteration.
+        chaos = numpy.array([list(x.chaos) for x in flame.xform]
+                            + [[1.0] * len(weights)])
+        probs = chaos * weights
+        empty = probs.sum(1) <= 0
+        probs[empty] = weights
+        self.cdf = numpy.cumsum(probs, 1)
+        self.cdf /= self.cdf[:, -1:]
+        self.chaos = bool((chaos != 1).any())
+        self.opacity = numpy.array([x.opacity for x in self.xforms])
+        self.rand = numpy.random.RandomState(seed)
+        self.batch_size = batch_size
+        self.badvals = 0
+        self.iterations = 0
+        self._reset()
+
+
+    def _random_points(self, n):
+        return (self.rand.uniform(-1, 1, n), self.rand.uniform(-1, 1, n),
+                self.rand.random_sample(n))
+
+
+    def _reset(self):
+        self.x, self.y, self.c = self._random_points(self.batch_size)
+        self.last = numpy.empty(self.batch_size, dtype=numpy.intp)
+        self.last.fill(len(self.xforms))
+        for i in range(FUSE):
+            self.step()
+        self.iterations = 0
+
+
+    def step(self):
+        """Applies one randomly picked xform to every point. Returns the
+        indices of the xforms used."""
+        r = self.rand.random_sample(self.batch_size)
+        if self.chaos:
+            index = (r[:,None] >= self.cdf[self.last]).sum(1)
+        else:
+            index = self.cdf[-1].searchsorted(r, 'right')
+        nx = numpy.empty(self.batch_size)
+        ny = numpy.empty(self.batch_size)
+        nc = numpy.empty(self.batch_size)
+        with numpy.errstate(all='ignore'):
+            for i, xf in enumerate(self.xforms):
+                sel = (index == i).nonzero()[0]
+                if len(sel):
+                    nx[sel], ny[sel], nc[sel] = xf.apply(
+                        self.x[sel], self.y[sel], self.c[sel], self.rand)
+            bad = ~(numpy.abs(nx) + numpy.abs(ny) < BAD_VALUE)
+        nbad = bad.sum()
+        if nbad:
+            # Like flam3, restart bad points at a random location.
+            nx[bad], ny[bad], nc[bad] = self._random_points(nbad)
+            self.badvals += nbad
+        self.x, self.y, self.c, self.last = nx, ny, nc, index
+        self.iterations += self.batch_size
+        return index
+
+
+    def points(self):
+        """Iterates once and returns the points to plot as (x, y, color,
+        opacity) arrays. The final xform is only applied to these, not to
+        the points that are iterated further."""
+        index = self.step()
+        x, y, c = self.x, self.y, self.c
+        if self.final is not None:
+            with numpy.errstate(all='ignore'):
+                x, y, c = self.final.apply(x, y, c, self.rand)
+        return x, y, c, self.opacity[index]
+
+
+
+class Camera(object):
+    """Maps flame coordinates to histogram buckets, like flam3 does for an
+    image of the given size."""
+    def __init__(self, flame, size):
+        self.width, self.height = size
+        self.ppu = flame.scale * self.width / 100.0 * \
+                   2 ** getattr(flame, 'zoom', 0)
+        self.center = flame.center
+        angle = -flame.rotate * math.pi / 180
+        self.rot = math.cos(angle), math.sin(angle)
+        self.corner = (self.center[0] - self.width / self.ppu / 2.0,
+                       self.center[1] - self.height / self.ppu / 2.0)
+
+
+    @property
+    def area(self):
+        return self.width * self.height / self.ppu**2
+
+
+    def buckets(self, x, y):
+        """Returns the bucket of every point, and a mask of the points that
+        fall inside the image."""
+        if self.rot != (1.0, 0.0):
+            cos, sin = self.rot
+            cx, cy = self.center
+            x, y = x - cx, y - cy
+            x, y = x*cos - y*sin + cx, x*sin + y*cos + cy
+        with numpy.errstate(invalid='ignore'):
+            px = numpy.floor((x - self.corner[0]) * self.ppu)
+            py = numpy.floor((y - self.corner[1]) * self.ppu)
+            inside = ((px >= 0) & (px < self.width) &
+                      (py >= 0) & (py < self.height))
+        return (py[inside] * self.width + px[inside]).astype(numpy.intp), inside
+
+
+
+def iterate(flame, size, quality, seed=None, batch_size=BATCH_SIZE,
+            histogram=None, lock=None):
+    """Runs the chaos game for quality samples per pixel and accumulates the
+    plotted points into a (height*width, 4) float array of rgb and
+    density, scaled like flam3's buckets. Pass histogram to accumulate
+    into an existing array, and lock if other processes add to it too.
+    Returns the histogram and the ChaosGame, whose iterations and badvals
+    can be used for stats."""
+    width, height = size
+    npixels = width * height
+    if histogram is None:
+        histogram = numpy.zeros((npixels, 4))
+    game = ChaosGame(flame, seed, batch_size)
+    camera = Camera(flame, size)
+    palette = numpy.asarray(flame.gradient.data, dtype=float)
+    total = int(quality * npixels)
+    rounds = max(1, -(-total // game.batch_size))
+    # bincount allocates a full histogram every call, so buckets are
+    # collected over several rounds before being added in.
+    flush = max(1, npixels // game.batch_size)
+    pending = []
+    for i in xrange(rounds):
+        x, y, c, opacity = game.points()
+        bucket, inside = camera.buckets(x, y)
+        color = numpy.clip((c[inside] * 256).astype(numpy.intp), 0, 255)
+        pending.append((bucket, color, opacity[inside]))
+        if len(pending) >= flush or i == rounds - 1:
+            bucket, color, opacity = (numpy.concatenate(a)
+                                      for a in zip(*pending))
+            del pending[:]
+            rgb = palette[color]
+            for j in range(4):
+                if j < 3:
+                    counts = numpy.bincount(bucket, rgb[:,j] * opacity, npixels)
+                else:
+                    counts = numpy.bincount(bucket, opacity, npixels) * 255
+                if lock is None:
+                    histogram[:,j] += counts
+                else:
+                    with lock:
+                        histogram[:,j] += counts
+    return histogram, game
+
+
+
+def _count_procs(nprocs):
+    if multiprocessing.current_process().daemon:
+        # e.g. a RenderService worker.
+        return 1
+    if nprocs <= 0:
+        nprocs = max(1, multiprocessing.cpu_count() + nprocs)
+    return nprocs
+
+
+def _iterate_part(conn, data, size, quality, seed, histogram, lock):
+    try:
+        from fr0stlib import Flame
+        flame = Flame().from_bytes(data)
+        histogram = numpy.frombuffer(histogram).reshape(-1, 4)
+        histogram, game = iterate(flame, size, quality, seed,
+                                  histogram=histogram, lock=lock)
+    except Exception as e:
+        conn.send(('error', (e, traceback.format_exc())))
+    else:
+        conn.send(('ok', (game.iterations, game.badvals)))
+    conn.close()
+
+
+def _reraise(e, tb):
+    """Raises an exception sent back by a worker as the same type, with
+    the worker's traceback in the message."""
+    try:
+        e = type(e)("%s\nTraceback in the render worker:\n%s" % (e, tb))
+    except Exception:
+        pass
+    raise e
+
+
+def iterate_parallel(flame, size, quality, nprocs=0, seed=None):
+    """Like iterate, but splits the samples over nprocs worker processes (0
+    means one per core, -1 all cores except one, etc). Each worker uses its
+    own seed, and they all accumulate into one histogram in shared memory.
+    An exception raised by a worker is raised here again. Returns the
+    histogram, the number of iterations and the number of bad values."""
+    nprocs = _count_procs(nprocs)
+    npixels = size[0] * size[1]
+    shared = RawArray('d', npixels * 4)
+    lock = multiprocessing.Lock()
+    seeds = numpy.random.RandomState(seed).randint(0, 2**31 - 1, nprocs)
+    data = flame.to_bytes()
+    procs, conns = [], []
+    for i in range(nprocs):
+        conn, child = multiprocessing.Pipe(False)
+        p = multiprocessing.Process(target=_iterate_part,
+                                    args=(child, data, size,
+                                          float(quality) / nprocs,
+                                          int(seeds[i]), shared, lock))
+        p.start()
+        child.close()
+        procs.append(p)
+        conns.append(conn)
+    results = []
+    try:
+        for conn in conns:
+            try:
+                results.append(conn.recv())
+            except EOFError:
+                # The worker died without reporting back.
+                results.append(None)
+        for p in procs:
+            p.join()
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        for conn in conns:
+            conn.close()
+    iterations = badvals = 0
+    for p, result in zip(procs, results):
+        if result is None:
+            raise RuntimeError("Render worker exited with code %s" % p.exitcode)
+        status, value = result
+        if status == 'error':
+            _reraise(*value)
+        iterations += value[0]
+        badvals += value[1]
+    histogram = numpy.frombuffer(shared).reshape(npixels, 4)
+    return histogram, int(iterations), int(badvals)
+
+
+
+def _calc_alpha(density, gamma, linrange):
+    """flam3's gamma curve, linear below linrange."""
+    funcval = linrange ** gamma
+    alpha = density ** gamma
+    if linrange > 0:
+        frac = density / linrange
+        low = (1.0 - frac) * density * (funcval / linrange) + frac * alpha
+        alpha = numpy.where(density < linrange, low, alpha)
+    return numpy.where(density > 0, alpha, 0.0)
+
+
+def tonemap(flame, size, quality, histogram, transparent=0, out=None,
+            iterations=None):
+    """Turns a histogram as returned by iterate into 8 bit rgb(a) pixels,
+    the way flam3 does. iterations is the number of points actually
+    plotted into the histogram; iterate runs whole batches, so it can be
+    well above quality samples per pixel, which is assumed if it isn't
+    given. The pixels are written into out if given (see
+    as_output_buffer), otherwise into a new output buffer, which is
+    returned."""
+    width, height = size
+    channels = 3 + bool(transparent)
+    if out is None:
+        output_buffer = allocate_output_buffer(size, channels)
+    else:
+        output_buffer = as_output_buffer(out, size, channels)
+    pixels = output_array(output_buffer, size, channels).reshape(-1, channels)
+    camera = Camera(flame, size)
+    density = histogram[:,3]
+    if iterations is not None:
+        quality = float(iterations) / (width * height)
+
+    # Log scaling of the buckets.
+    k1 = flame.brightness * PREFILTER_WHITE * 268.0 / 256
+    k2 = 1.0 / (camera.area * 255 * quality)
+    with numpy.errstate(all='ignore'):
+        ls = numpy.where(density > 0, k1 * numpy.log1p(density * k2) / density,
+                         0.0)
+    acc = histogram * ls[:,None]
+
+    # Gamma, vibrancy and highlights.
+    g = 1.0 / flame.gamma
+    vibrancy = flame.vibrancy
+    highpow = flame.highlight_power
+    tmp = acc[:,3] / PREFILTER_WHITE
+    alpha = _calc_alpha(tmp, g, flame.gamma_threshold)
+    with numpy.errstate(all='ignore'):
+        ls = numpy.where(tmp > 0, vibrancy * 256.0 * alpha / tmp, 0.0)
+    alpha = numpy.clip(alpha, 0.0, 1.0)
+    rgb = acc[:,:3] / PREFILTER_WHITE
+    maxc = rgb.max(1)
+    maxa = ls * maxc
+    with numpy.errstate(all='ignore'):
+        newls = numpy.where(maxc > 0, 255.0 / maxc, 0.0)
+        if highpow >= 0:
+            # Clip overexposed pixels to their brightest channel and
+            # desaturate them according to highlight_power.
+            over = maxa > 255
+            lsratio = numpy.where(over, (newls / ls) ** highpow, 1.0)
+            new = rgb * numpy.where(over, newls, ls)[:,None]
+            new = 255.0 - (255.0 - new) * lsratio[:,None]
+            newrgb = numpy.where(over[:,None], new, rgb * ls[:,None])
+        else:
+            adjhlp = numpy.where(maxa <= 255, 1.0, min(1.0, -highpow))
+            newrgb = rgb * ((1.0 - adjhlp) * newls + adjhlp * ls)[:,None]
+    newrgb[ls == 0] = 0
+    if vibrancy != 1:
+        newrgb += (1.0 - vibrancy) * 256.0 * rgb ** g
+    if transparent:
+        with numpy.errstate(all='ignore'):
+            newrgb = numpy.where(alpha[:,None] > 0, newrgb / alpha[:,None], 0)
+        pixels[:,3] = numpy.clip(alpha * 255, 0, 255)
+    else:
+        background = numpy.asarray(flame.background, dtype=float) * 255
+        newrgb += (1.0 - alpha)[:,None] * background
+    pixels[:,:3] = numpy.clip(newrgb, 0, 255)
+    return output_buffer
+
+
+def render(flame, size, quality, transparent=0, seed=None, nprocs=1,
+           out=None, array=False, **kwds):
+    """Renders flame at the given size and quality (samples per pixel).
+    With nprocs other than 1, the samples are split over several processes
+    (see iterate_parallel, 0 means one per core), except inside a daemonic
+    process, which can't start any. out and array work like in
+    Frame.render. Returns the output buffer (or array) and a stats dict
+    with the number of iterations, bad values, seconds and points per
+    second. Keywords that only apply to flam3 are ignored."""
+    if not all(size):
+        raise ZeroDivisionError("Size passed to render function is 0.")
+    if kwds.get('fixed_seed') and seed is None:
+        seed = 0
+    start = time.time()
+    nprocs = _count_procs(nprocs)
+    if nprocs == 1:
+        histogram, game = iterate(flame, size, quality, seed)
+        iterations, badvals = game.iterations, game.badvals
+    else:
+        histogram, iterations, badvals = iterate_parallel(flame, size, quality,
+                                                          nprocs, seed)
+    output_buffer = tonemap(flame, size, quality, histogram, transparent, out,
+                            iterations)
+    if array:
+        output_buffer = output_array(output_buffer if out is None else out,
+                                     size, 3 + bool(transparent))
+    seconds = time.time() - start
+    stats = dict(num_iters=iterations, badvals=badvals, render_seconds=seconds,
+                 points_per_second=iterations / max(seconds, 1e-9))
+    return output_buffer, stats
@@ -0,0 +1,233 @@
+##############################################################################
+#  Fractal Fr0st - fr0st
+#  https://launchpad.net/fr0st
+#
+#  Copyright (C) 2009 by Vitor Bosshard <algorias@gmail.com>
+#
+#  Fractal Fr0st is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Binary encoding of flames, used by Flame.to_bytes and Flame.from_bytes.
+
+Layout (little endian):
+
+    header      "FR0B", u16 format version
+    attributes  flame attributes (see below)
+    u16 n, u8 has_final
+    n (+1) xforms, the final one last:
+        attributes
+        6 f64 coefs, 6 f64 post coefs (both in Xform._coefs order)
+        u8 k, k u8 variation indices, k f64 values
+        u8 k, k u8 variable indices, k f64 values
+        u16 k, k f64 chaos values
+    768 bytes palette (rgb)
+
+attributes is a u16 count followed by that many (u8 name length, name,
+type, value) records. The type is one byte: 'd' f64, 'n' f64 that was a
+numpy.float64, 'q' i64, 'b' u8 bool, 's' (u32 length, bytes), 'v' (u16
+count, f64 values) or 't', the same as 'v' for a tuple.
+
+Values are stored exactly and come back with the same type (numpy.float64
+prints with more digits than a float), so to_string gives the same
+attributes and values before and after a round trip. As with Flame.copy,
+their order within a tag may differ, since it follows the dict."""
+import struct, numbers, numpy
+
+
+FORMAT_VERSION = 1
+MAGIC = "FR0B"
+
+_header = struct.Struct("<4sH")
+_u8 = struct.Struct("<B")
+_u16 = struct.Struct("<H")
+_u32 = struct.Struct("<I")
+_f64 = struct.Struct("<d")
+_i64 = struct.Struct("<q")
+_xforms = struct.Struct("<HB")
+_coefs = struct.Struct("<12d")
+
+
+class FormatError(ValueError):
+    pass
+
+
+def _pack_attributes(out, items):
+    items = list(items)
+    out.append(_u16.pack(len(items)))
+    for name, value in items:
+        out.append(_u8.pack(len(name)) + name)
+        if isinstance(value, basestring):
+            value = str(value)
+            out.append("s" + _u32.pack(len(value)) + value)
+        elif isinstance(value, bool):
+            out.append("b" + _u8.pack(value))
+        elif isinstance(value, numbers.Integral):
+            out.append("q" + _i64.pack(value))
+        elif isinstance(value, numpy.float64):
+            out.append("n" + _f64.pack(value))
+        elif isinstance(value, numbers.Real):
+            out.append("d" + _f64.pack(value))
+        else:
+            kind = "t" if isinstance(value, tuple) else "v"
+            value = numpy.asarray(value, dtype="<f8")
+            if value.ndim != 1:
+                raise TypeError("Can't encode %s=%r" % (name, value))
+            out.append(kind + _u16.pack(len(value)) + value.tostring())
+
+
+def _pack_sparse(out, values):
+    if values is None:
+        out.append(_u8.pack(0))
+        return
+    index = (values == values).nonzero()[0]
+    out.append(_u8.pack(len(index)))
+    out.append(index.astype(numpy.uint8).tostring())
+    out.append(values[index].astype("<f8").tostring())
+
+
+def dumps(flame):
+    out = [_header.pack(MAGIC, FORMAT_VERSION)]
+    _pack_attributes(out, ((k, v) for k, v in flame.__dict__.iteritems()
+                           if k not in ("xform", "final", "gradient")))
+    out.append(_xforms.pack(len(flame.xform), flame.final is not None))
+    for x in flame.iter_xforms():
+        _pack_attributes(out, x._iter_scalars())
+        out.append(_coefs.pack(*(x._coefs.tolist() + x.post._coefs.tolist())))
+        _pack_sparse(out, x._vars)
+        _pack_sparse(out, x._params)
+        chaos = list(x.chaos)
+        out.append(_u16.pack(len(chaos)))
+        out.append(struct.pack("<%sd" % len(chaos), *chaos))
+    out.append(numpy.asarray(flame.gradient.data, dtype=numpy.uint8).tostring())
+    return "".join(out)
+
+
+
+class _Reader(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, s):
+        values = s.unpack_from(self.data, self.pos)
+        self.pos += s.size
+        return values
+
+    def read(self, n):
+        if self.pos + n > len(self.data):
+            raise FormatError("Truncated flame data")
+        s = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return s
+
+    def array(self, dtype, n):
+        dtype = numpy.dtype(dtype)
+        if not n:
+            return numpy.empty(0, dtype)
+        return numpy.frombuffer(self.read(n * dtype.itemsize), dtype).copy()
+
+    def attributes(self):
+        (n,) = self.unpack(_u16)
+        items = []
+        for i in xrange(n):
+            (length,) = self.unpack(_u8)
+            name = self.read(length)
+            kind = self.read(1)
+            if kind == "d":
+                (value,) = self.unpack(_f64)
+            elif kind == "n":
+                (value,) = self.unpack(_f64)
+                value = numpy.float64(value)
+            elif kind == "q":
+                (value,) = self.unpack(_i64)
+                value = int(value)
+            elif kind == "b":
+                (value,) = self.unpack(_u8)
+                value = bool(value)
+            elif kind == "s":
+                (length,) = self.unpack(_u32)
+                value = self.read(length)
+            elif kind in "vt":
+                (length,) = self.unpack(_u16)
+                value = self.array("<f8", length).tolist()
+                if kind == "t":
+                    value = tuple(value)
+            else:
+                raise FormatError("Unknown attribute type %r" % kind)
+            items.append((name, value))
+        return items
+
+    def sparse(self, size):
+        (n,) = self.unpack(_u8)
+        if not n:
+            return None
+        index = self.array(numpy.uint8, n)
+        values = numpy.empty(size)
+        values.fill(numpy.nan)
+        values[index] = self.array("<f8", n)
+        return values
+
+
+def loads(data, flame):
+    """Decodes data into flame (normally a new Flame instance), the same way
+    Flame.from_element does for xml."""
+    from fr0stlib import Xform, PostXform, Chaos, VERSION, flam3_nvariations, \
+         variable_list
+    from fr0stlib.compatibility import compatibilize
+
+    try:
+        reader = _Reader(data)
+        magic, version = reader.unpack(_header)
+        if magic != MAGIC:
+            raise FormatError("Not a binary flame")
+        if version != FORMAT_VERSION:
+            raise FormatError("Unsupported binary flame version %s" % version)
+
+        attributes = reader.attributes()
+        nxforms, has_final = reader.unpack(_xforms)
+        xforms = []
+        chaos = []
+        for i in xrange(nxforms + has_final):
+            x = object.__new__(Xform)
+            x._parent = flame
+            x._extra = None
+            for name, value in reader.attributes():
+                setattr(x, name, value)
+            values = reader.unpack(_coefs)
+            x._coefs = numpy.array(values[:6])
+            x._vars = reader.sparse(flam3_nvariations)
+            x._params = reader.sparse(len(variable_list))
+            post = object.__new__(PostXform)
+            post._parent = x
+            post._coefs = numpy.array(values[6:])
+            post._vars = post._params = post._extra = None
+            x.post = post
+            (n,) = reader.unpack(_u16)
+            chaos.append(reader.array("<f8", n).tolist())
+            xforms.append(x)
+        gradient = reader.array(numpy.uint8, 768).reshape(256, 3)
+    except struct.error as e:
+        raise FormatError("Truncated flame data (%s)" % e)
+
+    flame.__dict__.update(attributes)
+    flame.gradient.data = gradient
+    flame.xform = xforms[:nxforms]
+    flame.final = xforms[nxforms] if has_final else None
+    for x, values in zip(xforms, chaos):
+        x.chaos = Chaos(x, values)
+
+    flame.name = str(flame.name)
+    compatibilize(flame, VERSION)
+    return flame
@@ -0,0 +1,279 @@
+##############################################################################
+#  Fractal Fr0st - fr0st
+#  https://launchpad.net/fr0st
+#
+#  Copyright (C) 2009 by Vitor Bosshard <algorias@gmail.com>
+#
+#  Fractal Fr0st is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Sidecar offset index and change journal for flame files.
+
+The index of foo.flame is stored in foo.flame.idx. It records the byte
+offset, length, name and md5 of every <flame> element, along with the
+mtime and size of the file it was built from. It is rebuilt in a single
+pass whenever the file changes. Flames are then read by slicing a mmap of
+the file, so fetching the last flame of a huge file costs the same as
+fetching the first.
+
+Incremental saves don't touch the flame file at all. The new flames are
+appended to foo.flame.journal, followed by a state line which lists the
+current content of the file as ranges of flames in the file and flames in
+the journal. The last complete state line wins, so a save interrupted at
+any point leaves the previous state intact. A journal only applies to the
+exact version of the file it was started on."""
+import os, re, json, mmap, hashlib
+
+
+INDEX_VERSION = 1
+INDEX_EXT = ".idx"
+JOURNAL_EXT = ".journal"
+
+_re_flame = re.compile(r'<flame .*?</flame>', re.DOTALL)
+_re_name = re.compile(r' name="(.*?)"')
+_journal_header = "# fr0st flame journal\n"
+_state_tag = "\n#state "
+
+
+def _name(s):
+    name = _re_name.search(s)
+    return name.group(1) if name else ""
+
+
+class FlameIndex(object):
+    """The flames of a file as (path, offset, length, name, md5) tuples, with
+    the journal (if any) applied."""
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.index_path = self.path + INDEX_EXT
+        self.journal_path = self.path + JOURNAL_EXT
+        self.entries = None
+        self._stamp = self.stamp()
+        if not self._read(self._stamp):
+            self.build(self._stamp)
+        self.flames = [(self.path,) + e for e in self.entries]
+        self.journaled = False
+        self._journal_end = 0
+        self._read_journal()
+
+
+    def stamp(self):
+        st = os.stat(self.path)
+        return st.st_mtime, st.st_size
+
+
+    def __len__(self):
+        return len(self.flames)
+
+
+    @property
+    def names(self):
+        return [f[3] for f in self.flames]
+
+
+    def find(self, name):
+        """Returns the positions of all flames called name."""
+        return [i for i, f in enumerate(self.flames) if f[3] == name]
+
+
+    def _read(self, stamp):
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return False
+        if (data.get('version') != INDEX_VERSION or
+            tuple(data.get('stamp', ())) != stamp):
+            return False
+        self.entries = [tuple(e) for e in data['entries']]
+        return True
+
+
+    def build(self, stamp=None):
+        """Scans the file once and writes the index next to it."""
+        stamp = stamp or self.stamp()
+        entries = []
+        with _Map(self.path) as data:
+            for m in _re_flame.finditer(data):
+                s = m.group()
+                entries.append((m.start(), len(s), _name(s),
+                                hashlib.md5(s).hexdigest()))
+        self.entries = entries
+        try:
+            _replace(self.index_path, lambda f: json.dump(
+                dict(version=INDEX_VERSION, stamp=stamp, entries=entries), f))
+        except (IOError, OSError):
+            # Read-only location. The index still works for this session.
+            pass
+
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with _Map(self.journal_path) as data:
+            pos = data.rfind(_state_tag)
+            while pos != -1:
+                end = data.find("\n", pos + 1)
+                try:
+                    state = json.loads(data[pos+len(_state_tag):end])
+                except ValueError:
+                    # Incomplete state line from an interrupted save.
+                    pos = data.rfind(_state_tag, 0, pos)
+                    continue
+                break
+            else:
+                return
+        if tuple(state['base']) != self._stamp:
+            # The file was saved without the journal since.
+            return
+        flames = []
+        for run in state['runs']:
+            if run[0] == 'b':
+                flames.extend(self.flames[run[1]:run[2]])
+            else:
+                flames.append((self.journal_path,) + tuple(run[1:]))
+        self.flames = flames
+        self.journaled = True
+        self._journal_end = end + 1
+
+
+    def update(self, strings):
+        """Records strings as the new content of the file in the journal.
+        Only flames that aren't in the file or journal already are written.
+        Returns the size of the journal."""
+        base = dict((e[0], i) for i, e in enumerate(self.entries))
+        known = dict((f[4], f) for f in self.flames)
+        known.update((e[3], (self.path,) + e) for e in self.entries)
+        if self.journaled:
+            f = open(self.journal_path, "r+b")
+            # Drop whatever an interrupted save left after the last state.
+            f.truncate(self._journal_end)
+            f.seek(self._journal_end)
+        else:
+            f = open(self.journal_path, "wb")
+            f.write(_journal_header)
+        with f:
+            flames = []
+            for s in strings:
+                md5 = hashlib.md5(s).hexdigest()
+                flame = known.get(md5)
+                if flame is None:
+                    flame = known[md5] = (self.journal_path, f.tell(), len(s),
+                                          _name(s), md5)
+                    f.write(s + "\n")
+                flames.append(flame)
+            runs = []
+            for flame in flames:
+                if flame[0] == self.path:
+                    i = base[flame[1]]
+                    if runs and runs[-1][0] == 'b' and runs[-1][2] == i:
+                        runs[-1][2] += 1
+                    else:
+                        runs.append(['b', i, i + 1])
+                else:
+                    runs.append(['j'] + list(flame[1:]))
+            f.write(_state_tag[1:] + json.dumps(dict(base=self._stamp,
+                                                     runs=runs)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self._journal_end = f.tell()
+        self.flames = flames
+        self.journaled = True
+        return self._journal_end
+
+
+    def discard_journal(self):
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.flames = [(self.path,) + e for e in self.entries]
+        self.journaled = False
+        self._journal_end = 0
+
+
+    def resolve(self, keys):
+        """Turns a sequence of positions and/or names into positions."""
+        result = []
+        for key in keys:
+            if isinstance(key, basestring):
+                found = self.find(key)
+                if not found:
+                    raise KeyError(key)
+                result.extend(found)
+            else:
+                result.append(range(len(self.flames))[key])
+        return result
+
+
+    def strings(self, keys=None):
+        """Returns the flame strings at the given positions or names, or all
+        of them if keys is None."""
+        return list(self.iter_strings(keys))
+
+
+    def iter_strings(self, keys=None):
+        """Like strings, but yields one string at a time. The file and
+        journal stay mapped until the generator is exhausted or closed."""
+        flames = self.flames if keys is None else \
+                 [self.flames[i] for i in self.resolve(keys)]
+        maps = {}
+        try:
+            for path, offset, length, _, _ in flames:
+                if path not in maps:
+                    m = _Map(path)
+                    maps[path] = m, m.__enter__()
+                yield maps[path][1][offset:offset+length]
+        finally:
+            for m, _ in maps.itervalues():
+                m.__exit__()
+
+
+
+def _replace(path, writer):
+    """Writes path through a temporary file, so it's never left half
+    written."""
+    tmp = "%s.%s.tmp" % (path, os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            writer(f)
+        if os.path.exists(path) and os.name == 'nt':
+            # Windows can't rename over an existing file.
+            os.remove(path)
+        os.rename(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+
+class _Map(object):
+    """Read-only mmap of a file, as a context manager. Empty files (which
+    can't be mapped) come out as an empty string."""
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except ValueError:
+            self.map = None
+            return ""
+        return self.map
+
+    def __exit__(self, *exc):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
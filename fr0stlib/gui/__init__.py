@@ -339,6 +339,10 @@ John Miller""" % fr0stlib.VERSION,
         
         self.renderer.exitflag = True
 
+        if self.tree.flamefiles:
+            # Leave a plain flame file behind for other programs.
+            fr0stlib.compact_flames(self.tree.GetFilePath())
+
         self.fh.SaveToConfig()
         self.editor.fh.SaveToConfig()
         self.editor.fav.SaveToConfig()
@@ -536,6 +540,7 @@ John Miller""" % fr0stlib.VERSION,
             # Parent needs to be selected to avoid a possible indexerror when
             # reducing the size of the tree.
             self.tree.SelectItem(self.tree.itemparent)
+            fr0stlib.compact_flames(self.tree.GetFilePath())
 
         if os.path.exists(path):
             # scan the file to see if it's valid
@@ -570,7 +575,7 @@ John Miller""" % fr0stlib.VERSION,
             data.Reset()
             self.tree.SetItemText(self.tree.item, data.name)
                 
-        save_flames(path, *(data[0] for data in lst))
+        save_flames(path, *(data[0] for data in lst), incremental=True)
         self.DumpChanges()
         # Make sure Undo and Redo get set correctly.
         self.SetFlame(self.flame, rezoom=False)
@@ -680,6 +685,7 @@ John Miller""" % fr0stlib.VERSION,
         def new_save_flames(path, *flames, **kwds):
             refresh = kwds.pop('refresh', True)
             confirm = kwds.pop('confirm', True)
+            incremental = kwds.pop('incremental', False)
             if kwds:
                 raise TypeError('Got unexpected keyword argument: %s'
                                 % tuple(kwds)[0])
@@ -693,7 +699,7 @@ John Miller""" % fr0stlib.VERSION,
                     return
 
             lst = [s if type(s) is str else s.to_string() for s in flames]
-            save_flames(path, *lst)
+            save_flames(path, *lst, incremental=incremental)
             if refresh:
                 self.tree.SetFlames(path, *lst)
 
@@ -129,7 +129,8 @@ class TreePanel(wx.Panel):
         self.tree.SelectItem(self.tree.itemparent) 
         self.tree.SelectItem(self.tree.GetItemByIndex((0,index)))
         
-        save_flames(path, *(i[0] for i in self.tree.GetDataGen()))
+        save_flames(path, *(i[0] for i in self.tree.GetDataGen()),
+                    incremental=True)
         self.parent.DumpChanges()
 
 
@@ -277,7 +278,7 @@ class FlameTree(treemixin.DragAndDrop, treemixin.VirtualTree, wx.TreeCtrl):
         self.item = self.GetItemByIndex((0, min(toindex, len(lst)-1)))
         self.SelectItem(self.item)
         
-        save_flames(path, *(i[0] for i in self.GetDataGen()))
+        save_flames(path, *(i[0] for i in self.GetDataGen()), incremental=True)
         self.parent.parent.DumpChanges()
 
 
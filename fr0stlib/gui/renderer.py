@@ -23,6 +23,7 @@ import time, sys, traceback, wx
 
 from fr0stlib.decorators import Catches, Threaded
 from fr0stlib.render import render_funcs
+from fr0stlib.pyflam3 import flam3_available
 from fr0stlib.gui.config import config
 from fr0stlib.gui._events import InMainFast
 
@@ -111,6 +112,8 @@ class Renderer():
     def process(self, callback, args, kwds):
         cancel_func = kwds.pop("cancel_func", None)
         renderer = kwds.pop("renderer")
+        if renderer == 'flam3' and not flam3_available:
+            renderer = 'numpy'
         try:
             render = render_funcs[renderer]
         except KeyError as e:
@@ -418,7 +418,7 @@ class VarPanel(wx.Panel):
             for j, name2 in self.itervars(i):
                 # Looping through variables
                 variable = "%s_%s" %(name, name2)
-                if variable not in xform.__dict__:
+                if not hasattr(xform, variable):
                     # Avoid overwriting variables set in GUI with value of 0
                     continue
                 attr = str(getattr(xform, variable))
@@ -0,0 +1,125 @@
+##############################################################################
+#  Fractal Fr0st - fr0st
+#  https://launchpad.net/fr0st
+#
+#  Copyright (C) 2009 by Vitor Bosshard <algorias@gmail.com>
+#
+#  Fractal Fr0st is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""Array versions of the pblend functions.
+
+The flame parameters that can be morphed are collected into arrays (see
+flame_arrays), which are blended between keyframes for any number of time
+values in one go. The result holds one row per time value and is written
+back into a flame with apply_arrays."""
+import math, numpy
+
+from fr0stlib.pyflam3.variations import variation_list
+
+
+def curve_factor(i, curve='linear'):
+    """Maps i (normalized between 0-1, scalar or array) through one of the
+    blending curves."""
+    cos = numpy.cos if isinstance(i, numpy.ndarray) else math.cos
+    if curve == 'linear':
+        return i
+    elif curve == 'cos':
+        return 0.5 * (cos((i+1)*math.pi)+1)
+    elif curve == 'cubic':
+        return 3*i*i - 2*i*i*i
+    else:
+        raise ValueError('invalid curve')
+
+
+def blend(start, end, times, curve='linear'):
+    """Blends two arrays for every value in times (normalized between 0-1).
+    Returns an array of shape times.shape + start.shape."""
+    start = numpy.asarray(start, dtype=numpy.float64)
+    end = numpy.asarray(end, dtype=numpy.float64)
+    times = numpy.asarray(times, dtype=numpy.float64)
+    t = curve_factor(times, curve).reshape(times.shape + (1,) * start.ndim)
+    return start + ((end-start) * t)
+
+
+def keyframe_blend(keys, values, times, curve='linear'):
+    """Blends between any number of keyframes. values[k] is the array at
+    time keys[k]; keys must be increasing. Times outside the keys are
+    clamped to the first or last keyframe."""
+    keys = numpy.asarray(keys, dtype=numpy.float64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    times = numpy.clip(numpy.asarray(times, dtype=numpy.float64),
+                       keys[0], keys[-1])
+    if len(keys) == 1:
+        return numpy.repeat(values, len(times), axis=0)
+    seg = numpy.clip(numpy.searchsorted(keys, times, 'right') - 1,
+                     0, len(keys) - 2)
+    i = (times - keys[seg]) / (keys[seg+1] - keys[seg])
+    t = curve_factor(i, curve).reshape(i.shape + (1,) * (values.ndim - 1))
+    start, end = values[seg], values[seg+1]
+    return start + ((end-start) * t)
+
+
+def flame_arrays(flame):
+    """Collects the morphable parameters of a flame into arrays, one row per
+    xform (final xform last):
+
+    coefs: (n, 6), post: (n, 6), weight: (n,), color: (n,),
+    variations: (n, nvariations) indexed like variation_list,
+    palette: (256, 3)"""
+    xforms = list(flame.iter_xforms())
+    return dict(coefs=numpy.array([x.coefs for x in xforms], dtype=float),
+                post=numpy.array([x.post.coefs for x in xforms], dtype=float),
+                weight=numpy.array([x.weight for x in xforms], dtype=float),
+                color=numpy.array([x.color for x in xforms], dtype=float),
+                variations=numpy.array([[getattr(x, name) for name in
+                                         variation_list] for x in xforms],
+                                       dtype=float),
+                palette=numpy.array(flame.gradient.data, dtype=float))
+
+
+def interpolate_flames(flames, times, keys=None, curve='linear'):
+    """Blends the parameters of a sequence of keyframe flames for every value
+    in times. keys default to 0, 1, ..., len(flames)-1. All flames need the
+    same xform layout. Returns a dict like flame_arrays, with an extra
+    leading axis of len(times)."""
+    arrays = [flame_arrays(f) for f in flames]
+    shape = arrays[0]['coefs'].shape
+    finals = set(f.final is None for f in flames)
+    if any(a['coefs'].shape != shape for a in arrays) or len(finals) > 1:
+        raise ValueError("Keyframe flames need the same number of xforms.")
+    if keys is None:
+        keys = range(len(flames))
+    return dict((k, keyframe_blend(keys, [a[k] for a in arrays], times, curve))
+                for k in arrays[0])
+
+
+def apply_arrays(flame, arrays, index=None):
+    """Writes arrays as returned by flame_arrays (or one row of the result
+    of interpolate_flames, selected by index) into flame."""
+    if index is not None:
+        arrays = dict((k, v[index]) for k, v in arrays.iteritems())
+    for i, x in enumerate(flame.iter_xforms()):
+        x.coefs = arrays['coefs'][i].tolist()
+        x.post.coefs = arrays['post'][i].tolist()
+        if not x.isfinal():
+            x.weight = float(arrays['weight'][i])
+        x.color = float(arrays['color'][i])
+        for name, value in zip(variation_list, arrays['variations'][i]):
+            if value or name in x.list_variations():
+                setattr(x, name, float(value))
+    flame.gradient.data = numpy.array(numpy.clip(arrays['palette'], 0, 255),
+                                      dtype=numpy.uint8)
+    return flame
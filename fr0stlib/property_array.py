@@ -20,14 +20,29 @@
 #  Boston, MA 02111-1307, USA.
 ##############################################################################
 import collections, sys, numpy
+from contextlib import contextmanager
+
+
+class _WriteBack(object):
+    """Writes an array back to the property it came from. Shared by the
+    array and all views taken from it, so a batch on any of them covers
+    writes through the others."""
+    def __init__(self, parent, instance, obj):
+        self.parent = parent
+        self.instance = instance
+        self.obj = obj
+        self.depth = 0
+
+    def __call__(self):
+        if not self.depth:
+            self.parent.fset(self.instance, self.obj)
+
 
 
 class _property_array(numpy.ndarray):
     def __new__(cls, parent, instance, data):
         obj = numpy.asarray(data).view(cls)
-        def callback():
-            parent.fset(instance, obj)
-        obj.callback = callback
+        obj.callback = _WriteBack(parent, instance, obj)
         return obj
 
 
@@ -48,6 +63,25 @@ class _property_array(numpy.ndarray):
 
     def __ne__(self, other):
         return not self == other
+
+
+    @contextmanager
+    def batch(self):
+        """Defers writing back to the property until the end of the block,
+        so any number of item assignments cost a single write. Nothing is
+        written if the block raises.
+
+        with xform.coefs.batch() as coefs:
+            coefs[0] *= 2
+            coefs[2:4] = 0, 1
+        """
+        callback = self.callback
+        callback.depth += 1
+        try:
+            yield self
+        finally:
+            callback.depth -= 1
+        callback()
     
 
 
@@ -19,7 +19,9 @@
 #  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 #  Boston, MA 02111-1307, USA.
 ##############################################################################
-import sys, os, marshal
+import sys, os, marshal, hashlib, numpy
+from collections import OrderedDict
+from threading import Lock
 
 from _flam3 import *
 
@@ -42,10 +44,19 @@ filter_kernel_dict = {"gaussian": 0,
 
 class Genome(BaseGenome):
     @classmethod
-    def load(cls, flamestring, ntemporal_samples=1, temporal_filter=1.0,
-             estimator=9, estimator_curve=.4, estimator_minimum=0,
-             spatial_oversample=1, filter_radius=1, filter_kernel=0,
-             interpolation=0, interpolation_type=1, **kwargs):
+    def load(cls, flamestring, **kwds):
+        return cls.load_genomes(*genome_cache.get(flamestring), **kwds)
+
+
+    @classmethod
+    def load_genomes(cls, genomes, ngenomes, ntemporal_samples=1,
+             temporal_filter=1.0, estimator=9, estimator_curve=.4,
+             estimator_minimum=0, spatial_oversample=1, filter_radius=1,
+             filter_kernel=0, interpolation=0, interpolation_type=1,
+             **kwargs):
+        """Makes a frame from already parsed genomes, e.g. patched copies of
+        a template made with copy_genome. The frame takes ownership of the
+        genomes."""
         if isinstance(filter_kernel, basestring):
             # if an invalid string is passed, let the KeyError propagate.
             filter_kernel = filter_kernel_dict[filter_kernel.lower()]
@@ -56,7 +67,7 @@ class Genome(BaseGenome):
             kwargs["earlyclip"] = True
         
         frame = Frame(**kwargs)
-        frame.genomes, frame.ngenomes = cls.from_string(flamestring)
+        frame.genomes, frame.ngenomes = genomes, ngenomes
         
         for i, genome in enumerate(frame.iter_genomes()):
             genome.interpolation = interpolation
@@ -110,6 +121,178 @@ class Genome(BaseGenome):
 
 
 
+def copy_genome(genome):
+    """Returns a flam3-allocated deep copy of a genome, suitable to be handed
+    to Genome.load_genomes."""
+    ptr = flam3_malloc(sizeof(BaseGenome))
+    if not ptr:
+        raise MemoryError()
+    memset(ptr, 0, sizeof(BaseGenome))
+    result = cast(ptr, POINTER(BaseGenome))
+    flam3_copy(result, byref(genome))
+    return result
+
+
+def copy_genomes(genomes, ngenomes):
+    """Same as copy_genome, for an array of ngenomes genomes."""
+    ptr = flam3_malloc(ngenomes * sizeof(BaseGenome))
+    if not ptr:
+        raise MemoryError()
+    memset(ptr, 0, ngenomes * sizeof(BaseGenome))
+    result = cast(ptr, POINTER(BaseGenome))
+    for i in xrange(ngenomes):
+        flam3_copy(byref(result[i]), byref(genomes[i]))
+    return result
+
+
+class GenomeCache(object):
+    """Keeps the most recently parsed genomes, keyed by the md5 of the
+    flame string, and hands out copies (see copy_genomes). Frame.render
+    changes width, sample_density etc. of the genomes it's given, so the
+    cached originals are never handed out themselves."""
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._genomes = OrderedDict()
+        self._lock = Lock()
+
+
+    def key(self, string):
+        return hashlib.md5(string.strip().replace("\r\n", "\n")).digest()
+
+
+    def get(self, string):
+        """Returns a (genomes, ngenomes) copy, like Genome.from_string."""
+        key = self.key(string)
+        with self._lock:
+            entry = self._genomes.pop(key, None)
+            if entry is None:
+                entry = Genome.from_string(string)
+                if not entry[1]:
+                    # Parsing failed, don't keep the result around.
+                    return entry
+                while len(self._genomes) >= self.maxsize:
+                    genomes, ngenomes = self._genomes.popitem(last=False)[1]
+                    flam3_free(genomes)
+            self._genomes[key] = entry
+            return copy_genomes(*entry), entry[1]
+
+
+    def clear(self):
+        with self._lock:
+            for genomes, ngenomes in self._genomes.itervalues():
+                flam3_free(genomes)
+            self._genomes.clear()
+
+
+genome_cache = GenomeCache()
+
+
+# Three xforms whose fields are all distinct and exactly representable:
+# (weight, color, linear, coefs, post), coefs and post in flame file order.
+_probe_xforms = (
+    (0.25, 0.125, 1.0, (1.0, 0.0, 0.0, 1.0, 0.0, 0.0),
+     (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)),
+    (0.5, 0.375, 0.75, (0.1171875, -0.2109375, 0.3203125, -0.4296875,
+                        0.5390625, -0.6484375),
+     (0.5, 0.25, -0.25, 0.5, 0.125, -0.125)),
+    (0.75, 0.625, 0.5, (-0.0390625, 0.8515625, 0.2265625, 0.6640625,
+                        -0.9609375, 0.4921875),
+     (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)),
+    )
+_probe = '<flame>%s</flame>' % ''.join(
+    '<xform weight="%r" color="%r" linear="%r" coefs="%s" post="%s"/>'
+    % (weight, color, linear, ' '.join(map(repr, coefs)),
+       ' '.join(map(repr, post)))
+    for weight, color, linear, coefs, post in _probe_xforms)
+_xform_size = []
+
+def _flat(pairs):
+    return tuple(c for pair in pairs for c in pair)
+
+
+def _probe_matches(xf, (weight, color, linear, coefs, post)):
+    return (xf.density == weight and xf.color == color and
+            xf.var[variations['linear']] == linear and
+            _flat(xf.c) == coefs and _flat(xf.post) == post)
+
+
+def xform_size():
+    """Returns sizeof(flam3_xform).
+
+    libflam3 doesn't export it and the struct has too many fields to mirror
+    reliably, so it's measured once: a genome with three xforms is parsed
+    and the coefs of the second one are looked up behind the first. The
+    size is only accepted if the leading fields (XFormHead) of all three
+    xforms then read back as parsed. Otherwise patching would write to the
+    wrong place, so RuntimeError is raised instead."""
+    if not _xform_size:
+        genomes, ngenomes = Genome.from_string(_probe)
+        try:
+            if ngenomes != 1 or genomes[0].num_xforms != len(_probe_xforms):
+                raise RuntimeError("Can't parse the flam3_xform probe")
+            base = cast(genomes[0].xform, c_void_p).value
+            if not _probe_matches(XFormHead.from_address(base),
+                                  _probe_xforms[0]):
+                raise RuntimeError("XFormHead doesn't match flam3_xform")
+            offset = XFormHead.c.offset
+            coefs = _probe_xforms[1][3]
+            for size in xrange(sizeof(XFormHead), 1 << 16, sizeof(c_double)):
+                c = (c_double * 6).from_address(base + size + offset)
+                if tuple(c) == coefs:
+                    break
+            else:
+                size = None
+            if size is None or not all(
+                _probe_matches(XFormHead.from_address(base + i * size), spec)
+                for i, spec in enumerate(_probe_xforms)):
+                raise RuntimeError("Can't determine the size of flam3_xform")
+            _xform_size.append(size)
+        finally:
+            flam3_free(genomes)
+    return _xform_size[0]
+
+
+def get_xform(genome, index):
+    """Returns the leading fields of a genome's xform as an XFormHead that
+    shares memory with the genome."""
+    if not 0 <= index < genome.num_xforms:
+        raise IndexError(index)
+    base = cast(genome.xform, c_void_p).value
+    return XFormHead.from_address(base + index * xform_size())
+
+
+def set_xform(genome, index, coefs=None, post=None, weight=None, color=None,
+              color_speed=None, animate=None, opacity=None, **var):
+    """Patches an xform of a parsed genome in place. coefs and post are given
+    in flame file order, variations by name."""
+    xf = get_xform(genome, index)
+    if coefs is not None:
+        memmove(xf.c, (c_double * 6)(*coefs), sizeof(xf.c))
+    if post is not None:
+        memmove(xf.post, (c_double * 6)(*post), sizeof(xf.post))
+    if weight is not None:
+        xf.density = weight
+    if color is not None:
+        xf.color = color
+    if color_speed is not None:
+        xf.color_speed = color_speed
+    if animate is not None:
+        xf.animate = animate
+    if opacity is not None:
+        xf.opacity = opacity
+    for name, value in var.iteritems():
+        xf.var[variations[name]] = value
+
+
+def set_palette(genome, data):
+    """Writes 256 rgb entries (0-255) into a genome's palette."""
+    entries = numpy.frombuffer(genome.palette.entries, dtype=numpy.float64)
+    entries = entries.reshape(256, 5)
+    entries[:, 0] = numpy.arange(256)
+    entries[:, 1:4] = numpy.asarray(data, dtype=numpy.float64) / 255.0
+    entries[:, 4] = 1.0
+
+
 class Frame(BaseFrame):
     def __del__(self):
         # TODO: what if self.genomes is not set?
@@ -144,7 +327,12 @@ class Frame(BaseFrame):
             yield self.genomes[i]
             
 
-    def render(self, size, quality, transparent=0, time=0):
+    def render(self, size, quality, transparent=0, time=0, out=None,
+               array=False):
+        """Renders the genome at index time. The image is written into out
+        if given (see as_output_buffer), otherwise into a new buffer. With
+        array=True, a (height, width, channels) numpy view of the buffer is
+        returned instead of the buffer itself."""
         if not all(size):
             raise ZeroDivisionError("Size passed to render function is 0.")
 
@@ -157,9 +345,16 @@ class Frame(BaseFrame):
         genome.height = height
         genome.sample_density = quality
 
-        output_buffer = allocate_output_buffer(size, transparent+3)
+        channels = transparent + 3
+        if out is None:
+            output_buffer = allocate_output_buffer(size, channels)
+        else:
+            output_buffer = as_output_buffer(out, size, channels)
         stats = RenderStats()
         flam3_render(byref(self), output_buffer, flam3_field_both,
-                     transparent+3, transparent, byref(stats))
+                     channels, transparent, byref(stats))
 
+        if array:
+            return output_array(output_buffer if out is None else out, size,
+                                channels), stats
         return output_buffer, stats
@@ -19,14 +19,42 @@
 #  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 #  Boston, MA 02111-1307, USA.
 ##############################################################################
-import itertools, sys, os
+import itertools, sys, os, numpy
 from ctypes import *
 from fr0stlib.pyflam3.constants import *
 from fr0stlib.pyflam3.variations import *
 from fr0stlib.pyflam3.find_dll import find_dll
 
 
-libflam3 = find_dll('libflam3')
+class _MissingFunction(object):
+    """Stands in for a function of a library that couldn't be loaded, so
+    the argtypes and restype declarations below still work."""
+    def __init__(self, name, error):
+        self.__name__ = name
+        self.error = error
+
+    def __call__(self, *args):
+        raise OSError("%s is not available: %s" % (self.__name__, self.error))
+
+
+class _MissingLibrary(object):
+    def __init__(self, error):
+        self.error = error
+        self._functions = {}
+
+    def __getattr__(self, name):
+        if name not in self._functions:
+            self._functions[name] = _MissingFunction(name, self.error)
+        return self._functions[name]
+
+
+try:
+    libflam3 = find_dll('libflam3')
+except OSError as e:
+    # Importing still works, so other renderers (see fr0stlib.render) can
+    # be used. Calling any flam3 function raises OSError.
+    libflam3 = _MissingLibrary(e)
+flam3_available = not isinstance(libflam3, _MissingLibrary)
 
 
 IteratorFunction = CFUNCTYPE(None, c_void_p, c_double)
@@ -67,6 +95,19 @@ class BasePalette(Structure):
 
 class BaseXForm(Structure): pass
 
+class XFormHead(Structure):
+    """Leading fields of flam3_xform. The full struct isn't mirrored, so this
+    can't be used for pointer arithmetic. See xform_size."""
+    _fields_ = [ ('var', c_double * flam3_nvariations)
+               , ('c', (c_double * 2) * 3)
+               , ('post', (c_double * 2) * 3)
+               , ('density', c_double)
+               , ('color', c_double)
+               , ('color_speed', c_double)
+               , ('animate', c_double)
+               , ('opacity', c_double)
+               ]
+
 class BaseGenome(Structure):
     _fields_ = [ ('name', c_char * (flam3_name_len + 1))
                , ('time', c_double)
@@ -144,6 +185,40 @@ class BaseFrame(Structure):
 def allocate_output_buffer(size, channels):
     return (c_ubyte * (size[0] * size[1] * channels))()
 
+
+def as_output_buffer(out, size, channels):
+    """Returns a caller-provided output buffer as a c_ubyte array that
+    shares its memory (and keeps out alive). out is either a buffer from
+    allocate_output_buffer or a writable, contiguous uint8 numpy array, of
+    at least the size needed for the image."""
+    nbytes = size[0] * size[1] * channels
+    if isinstance(out, numpy.ndarray):
+        if (out.dtype != numpy.uint8 or not out.flags.c_contiguous
+            or not out.flags.writeable):
+            raise ValueError("Output array must be writable, contiguous "
+                             "and of type uint8.")
+        if out.nbytes < nbytes:
+            raise ValueError("Output array too small: %s < %s bytes."
+                             % (out.nbytes, nbytes))
+        return (c_ubyte * nbytes).from_buffer(out)
+    if sizeof(out) < nbytes:
+        raise ValueError("Output buffer too small: %s < %s bytes."
+                         % (sizeof(out), nbytes))
+    return out
+
+
+def output_array(buffer, size, channels):
+    """Returns a (height, width, channels) uint8 numpy view of an output
+    buffer, or of a numpy array passed as out to a render function. No data
+    is copied."""
+    width, height = size
+    count = width * height * channels
+    if isinstance(buffer, numpy.ndarray):
+        array = buffer.reshape(-1)[:count]
+    else:
+        array = numpy.frombuffer(buffer, dtype=numpy.uint8, count=count)
+    return array.reshape(height, width, channels)
+
 #-----------------------------------------------------------------------------
 
 #int flam3_colorhist(flam3_genome *cp, int num_batches, randctx *rc, double *hist)
@@ -178,6 +253,10 @@ libflam3.flam3_print_to_string.argtypes = [POINTER(BaseGenome)]
 libflam3.flam3_print_to_string.restype = c_char_p
 flam3_print_to_string = libflam3.flam3_print_to_string
 
+# void flam3_copy(flam3_genome *dest, flam3_genome *src);
+libflam3.flam3_copy.argtypes = [POINTER(BaseGenome), POINTER(BaseGenome)]
+flam3_copy = libflam3.flam3_copy
+
 # int flam3_count_nthreads(void);
 libflam3.flam3_count_nthreads.restype = c_int
 flam3_count_nthreads = libflam3.flam3_count_nthreads
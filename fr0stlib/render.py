@@ -19,20 +19,19 @@
 #  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 #  Boston, MA 02111-1307, USA.
 ##############################################################################
-import wx, os
-import xml.etree.cElementTree as etree
+import os, re
 
 import fr0stlib
 from fr0stlib import Flame
 from fr0stlib.pyflam3 import Genome
 
 
-types = {".bmp": wx.BITMAP_TYPE_BMP,
-         ".png": wx.BITMAP_TYPE_PNG,
-         ".jpg": wx.BITMAP_TYPE_JPEG}
-
-
 def save_image(path, img, jpg_quality=95):
+    # wx is imported here so headless users of this module don't need it.
+    import wx
+    types = {".bmp": wx.BITMAP_TYPE_BMP,
+             ".png": wx.BITMAP_TYPE_PNG,
+             ".jpg": wx.BITMAP_TYPE_JPEG}
     if isinstance(img, wx.Bitmap):
         img = wx.ImageFromBitmap(img)
     ty = types[os.path.splitext(path)[1]]
@@ -44,9 +43,15 @@ def save_image(path, img, jpg_quality=95):
     img.SaveFile(path, ty)
 
 
+_re_version = re.compile(r'\sversion=(["\'])(.*?)\1')
+
 def needs_conversion(string):
-    root = etree.fromstring(string)
-    return root.get('version', None) != fr0stlib.VERSION
+    """Checks the version attribute of the flame tag. Only the tag itself
+    is looked at, the rest of the string isn't parsed."""
+    start = string.find('<flame')
+    end = string.find('>', start)
+    version = _re_version.search(string, start, end)
+    return version is None or version.group(2) != fr0stlib.VERSION
 
 
 def to_string(flame):
@@ -57,10 +62,13 @@ def to_string(flame):
     return flame.to_string()
 
 
-def flam3_render(flame, size, quality, transparent=0, **kwds):
-    """Passes render requests on to flam3."""
+def flam3_render(flame, size, quality, transparent=0, out=None, array=False,
+                 **kwds):
+    """Passes render requests on to flam3. See Frame.render for out and
+    array."""
     frame = Genome.load(to_string(flame), **kwds)
-    output_buffer, stats = frame.render(size, quality, transparent)
+    output_buffer, stats = frame.render(size, quality, transparent, out=out,
+                                        array=array)
     return output_buffer
     
 
@@ -73,5 +81,17 @@ def flam4_render(flame, size, quality, **kwds):
     return output_buffer
 
 
+def numpy_render(flame, size, quality, transparent=0, **kwds):
+    """Renders with the numpy chaos game, which doesn't need libflam3.
+    Accepts out and array like flam3_render, and nthreads like Frame
+    (each thread being a process here)."""
+    from fr0stlib.chaosgame import render
+    flame = flame if type(flame) is Flame else Flame(flame)
+    kwds.setdefault('nprocs', kwds.pop('nthreads', 0))
+    output_buffer, stats = render(flame, size, quality, transparent, **kwds)
+    return output_buffer
+
+
 render_funcs = {'flam3': flam3_render,
-                'flam4': flam4_render}
+                'flam4': flam4_render,
+                'numpy': numpy_render}
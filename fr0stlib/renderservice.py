@@ -0,0 +1,211 @@
+##############################################################################
+#  Fractal Fr0st - fr0st
+#  https://launchpad.net/fr0st
+#
+#  Copyright (C) 2009 by Vitor Bosshard <algorias@gmail.com>
+#
+#  Fractal Fr0st is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+"""A pool of long-lived render processes.
+
+Each worker imports the renderer (loading libflam3) once and then serves
+jobs sent over its own pipe. Images are written into a block of shared
+memory that belongs to the worker, so only a short status message goes
+back through the pipe. A worker that crashes (e.g. a segfault inside
+libflam3) or exceeds the timeout is replaced by a fresh one, and only the
+job it was running fails."""
+import ctypes, traceback, multiprocessing, Queue
+from multiprocessing.pool import ThreadPool
+from multiprocessing.sharedctypes import RawArray
+
+import numpy
+
+from fr0stlib.pyflam3._flam3 import as_output_buffer, output_array
+
+
+class RenderError(RuntimeError):
+    pass
+
+class RenderTimeout(RenderError):
+    pass
+
+class WorkerCrashed(RenderError):
+    pass
+
+
+def _serve(conn, output, renderer):
+    from fr0stlib.render import render_funcs
+    render = render_funcs[renderer]
+    output = numpy.frombuffer(output, dtype=numpy.uint8)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        args, kwds = job
+        try:
+            result = numpy.frombuffer(render(*args, **kwds), dtype=numpy.uint8)
+            output[:len(result)] = result
+        except Exception as e:
+            conn.send(('error', "%s: %s\n%s" % (type(e).__name__, e,
+                                                traceback.format_exc())))
+        else:
+            conn.send(('ok', len(result)))
+
+
+class _Worker(object):
+    def __init__(self, renderer, nbytes):
+        self.nbytes = nbytes
+        self.output = RawArray(ctypes.c_ubyte, nbytes)
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve,
+                                               args=(child, self.output,
+                                                     renderer))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+
+    def stop(self, kill=False):
+        if not kill:
+            try:
+                self.conn.send(None)
+            except (IOError, EOFError):
+                kill = True
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+
+class RenderService(object):
+    """Renders flames in a pool of worker processes. It's safe to call
+    render from several threads at once; each call blocks until a worker
+    is free.
+
+    processes works like Frame's nthreads: 0 means one per core, -1 all
+    cores except one, etc. size is the largest image (in pixels) workers
+    allocate output memory for up front; a worker asked for a larger one
+    is restarted with enough memory. timeout (in seconds) applies to
+    every job unless overridden in render."""
+    def __init__(self, processes=0, renderer='flam3', timeout=None,
+                 size=(1024, 768)):
+        if processes <= 0:
+            processes = max(1, multiprocessing.cpu_count() + processes)
+        self.processes = processes
+        self.renderer = renderer
+        self.timeout = timeout
+        self._nbytes = size[0] * size[1] * 4
+        self._idle = Queue.Queue()
+        for i in range(processes):
+            self._idle.put(_Worker(renderer, self._nbytes))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        for i in range(self.processes):
+            worker = self._idle.get()
+            if worker is not None:
+                worker.stop()
+        self.processes = 0
+
+
+    def render(self, flame, size, quality, transparent=0, timeout=None,
+               out=None, array=False, **kwds):
+        """Same arguments and result as the functions in
+        render.render_funcs. out and array are handled here, the image is
+        copied from the worker's memory straight into out. Raises
+        RenderTimeout or WorkerCrashed if the worker doesn't deliver, and
+        RenderError if the renderer raised an exception."""
+        if not isinstance(flame, basestring):
+            flame = flame.to_string()
+        if timeout is None:
+            timeout = self.timeout
+        nbytes = size[0] * size[1] * 4
+        # None stands for a worker that died and couldn't be replaced. The
+        # slot stays in the queue so close() still sees every process.
+        worker = self._idle.get()
+        try:
+            if worker is None or worker.nbytes < nbytes:
+                if worker is not None:
+                    old, worker = worker, None
+                    old.stop()
+                try:
+                    worker = _Worker(self.renderer, max(nbytes, self._nbytes))
+                except Exception as e:
+                    # The slot stays empty, the next job tries again.
+                    raise WorkerCrashed("Couldn't start a render worker: %s"
+                                        % e)
+            try:
+                worker.conn.send(((flame, size, quality, transparent), kwds))
+                if not worker.conn.poll(timeout):
+                    raise RenderTimeout("Render took longer than %ss" % timeout)
+                status, value = worker.conn.recv()
+            except (IOError, EOFError, RenderTimeout) as e:
+                # The worker is dead or stuck, replace it. If that fails
+                # too, the next job tries again.
+                dead, worker = worker, None
+                dead.stop(kill=True)
+                try:
+                    worker = _Worker(self.renderer, dead.nbytes)
+                except Exception:
+                    pass
+                if isinstance(e, RenderTimeout):
+                    raise
+                raise WorkerCrashed("Render worker exited with code %s" %
+                                    dead.process.exitcode)
+            if status == 'error':
+                raise RenderError(value)
+            channels = value // (size[0] * size[1])
+            if out is None:
+                output_buffer = (ctypes.c_ubyte * value)()
+            else:
+                output_buffer = as_output_buffer(out, size, channels)
+            ctypes.memmove(output_buffer, worker.output, value)
+            if array:
+                return output_array(output_buffer if out is None else out,
+                                    size, channels)
+            return output_buffer
+        finally:
+            self._idle.put(worker)
+
+
+    def map(self, flames, size, quality, **kwds):
+        """Renders a sequence of flames with the same settings, using all
+        workers. Returns a list with an output buffer for every flame, or
+        the RenderError raised while rendering it."""
+        def job(flame):
+            try:
+                return self.render(flame, size, quality, **kwds)
+            except RenderError as e:
+                return e
+        pool = ThreadPool(self.processes)
+        try:
+            return pool.map(job, flames)
+        finally:
+            pool.close()
+            pool.join()
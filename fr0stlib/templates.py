@@ -0,0 +1,112 @@
+##############################################################################
+#  Fractal Fr0st - fr0st
+#  https://launchpad.net/fr0st
+#
+#  Copyright (C) 2009 by Vitor Bosshard <algorias@gmail.com>
+#
+#  Fractal Fr0st is free software; you can redistribute
+#  it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Library General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this library; see the file COPYING.LIB.  If not, write to
+#  the Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+#  Boston, MA 02111-1307, USA.
+##############################################################################
+import os
+from threading import Lock
+
+from fr0stlib import load_flames
+from fr0stlib.pyflam3 import Genome, copy_genome, flam3_free
+
+
+class _Entry(object):
+    def __init__(self, path, stamp):
+        self.stamp = stamp
+        self.flames = load_flames(path)
+        self.genomes = {}
+
+    def free(self):
+        for genomes, ngenomes in self.genomes.itervalues():
+            flam3_free(genomes)
+        self.genomes.clear()
+
+
+class TemplateRegistry(object):
+    """Parses each flame file once and hands out copies of its flames.
+
+    Entries are checked against the mtime and size of their file on every
+    access and reloaded when it changes. Flames are handed out with
+    Flame.copy, genomes with pyflam3.copy_genome, so the cached originals
+    are never modified by the caller. Worker processes forked after a
+    template has been loaded inherit the parsed entry."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = Lock()
+
+
+    def stamp(self, path):
+        st = os.stat(path)
+        return st.st_mtime, st.st_size
+
+
+    def _entry(self, path):
+        path = os.path.abspath(path)
+        stamp = self.stamp(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry.stamp != stamp:
+                if entry is not None:
+                    entry.free()
+                entry = self._entries[path] = _Entry(path, stamp)
+            return entry
+
+
+    def _index(self, entry, key):
+        if isinstance(key, basestring):
+            for i, flame in enumerate(entry.flames):
+                if flame.name == key:
+                    return i
+            raise KeyError(key)
+        return key
+
+
+    def flames(self, path):
+        """Returns copies of all flames in path."""
+        return [f.copy() for f in self._entry(path).flames]
+
+
+    def flame(self, path, key=0):
+        """Returns a copy of one flame, selected by index or name."""
+        entry = self._entry(path)
+        return entry.flames[self._index(entry, key)].copy()
+
+
+    def genome(self, path, key=0):
+        """Returns a flam3-allocated copy of the parsed genome of a flame,
+        ready for Genome.load_genomes."""
+        entry = self._entry(path)
+        index = self._index(entry, key)
+        with self._lock:
+            if index not in entry.genomes:
+                entry.genomes[index] = Genome.from_string(
+                    entry.flames[index].to_string())
+            genomes, ngenomes = entry.genomes[index]
+        return copy_genome(genomes[0])
+
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.itervalues():
+                entry.free()
+            self._entries.clear()
+
+
+registry = TemplateRegistry()
@@ -1,93 +1,138 @@
 # -*- coding: cp936 -*-
-import fr0stlib
-import xml.etree.ElementTree
-import xml.etree.cElementTree as etree
-from fr0stlib.render import *
-from xml.dom import minidom
-import pygame,hashlib,colorsys,sys,os
+from fr0stlib.pyflam3 import Genome, copy_genome, set_xform, set_palette, flam3_free
+from fr0stlib.templates import registry
+from fr0stlib import hsv2rgb_array
+import argparse,hashlib,sys,os
 import numpy as np
 from random import *
-import wave
-
-xform_const1=[['opacity','1.0'],
-             ['weight','0.33333'],
-             ['color','0.446'],
-             ['color_speed',"0.5"],
-             ['gaussian_blur',"0.7"],
-             ['spiral',"0.549182653893"],
-             ['animate',"1.0" ]]
-
-xform_const2=[['opacity','1.0'],
-             ['weight','0.33333'],
-             ['color','1'],
-             ['color_speed',"0.5"],
-             ['swirl',"0.5"],
-             ['horseshoe',"0.549182653893"],
-             ['animate',"1.0" ]]
+from audio import WaveSource, Decimator
+from analysis import sliceFrequencies
+from cache import AnalysisCache
+
+xform_const1=dict(opacity=1.0,
+                  weight=0.33333,
+                  color=0.446,
+                  color_speed=0.5,
+                  gaussian_blur=0.7,
+                  spiral=0.549182653893,
+                  animate=1.0)
+
+xform_const2=dict(opacity=1.0,
+                  weight=0.33333,
+                  color=1.0,
+                  color_speed=0.5,
+                  swirl=0.5,
+                  horseshoe=0.549182653893,
+                  animate=1.0)
 
 def getHash(data):
     return int(hashlib.new("md5", str(data)).hexdigest(),16)
 
-def getAudio(path):
-    audioData=wave.open(path)
-    audioData=audioData.readframes(audioData.getnframes())
-    audioData=np.fromstring(audioData, dtype=np.short)
-    audioData.shape = -1, 2
-    audioData = audioData.T
-    audioData=audioData[0][0:-1:10]
-    return audioData
-
-def findkey(subarray):
-    
-    nSampleNum = 44100.
-    ncount = subsoundArray.size
-    df = nSampleNum / ncount
-    sampleTime = ncount / nSampleNum
-    maxfreq=20000
-    freqLine = maxfreq/df
-
-    x = np.linspace(0,sampleTime,ncount)#ʱx
-
-    fft = np.fft.fft(subsoundArray)[20/df:freqLine]  #fft任㷨Ƶ
-    fftx = np.linspace(20,df*freqLine,(maxfreq-20)/df)  #Ƶx311)
-    fftls=list(abs(fft))
-    maxffts=max(fftls)
-    maxfttsFrequency=fftx[fftls.index(maxffts)]
-    return maxfttsFrequency
-
-def render(flame_string,level,path):
-  
-    tree = etree.fromstring(flame_string)
-    flame=[fr0stlib.Flame().from_element(e) for e in tree.findall('flame')][0]
-
-    a=flam3_render(flame,[640,480],level)
-    b=wx.BitmapFromBuffer(640,480,a)
-    save_image(path,b)
-    
-def addXfromElement(flame,fromconst):
-    xform=minidom.getDOMImplementation().createDocument(None, 'catalog', None).createElement('xform')
-    for i in fromconst:
-        xform.setAttribute(i[0],i[1])
-    coefs=""
-    for i in range(6):
-        coefs+=str(random()*2-1)+' '
-    coefs=coefs[:-1]
-    xform.setAttribute('coefs',coefs)
-    flame.appendChild(xform)
+def getAudio(path, factor=10):
+    source=WaveSource(path)
+    decimator=Decimator(factor)
+    samples=np.concatenate(list(decimator.stream(source.blocks(channel=0))))
+    return samples, source.context.decimated(factor)
+
+def analyseMusic(path, sliceNum=256, factor=10, trim=1.0):
+    soundArray,context=getAudio(path, factor)
+    trim=context.frames(trim)
+    soundArray=soundArray[trim:-trim]
+    return sliceFrequencies(soundArray,context,sliceNum)/2000
+
+def getMusicInfo(path, sliceNum=256, cache=None, factor=10, trim=1.0):
+    if cache is None:
+        return list(analyseMusic(path, sliceNum, factor, trim))
+    musicInfo=cache.lookup(path, lambda: analyseMusic(path, sliceNum, factor, trim),
+                           sliceNum=sliceNum, factor=factor, trim=trim)
+    return list(musicInfo)
+
+def saveImage(path,buf,size):
+    # pygame is only needed here, so it isn't imported at startup.
+    import pygame
+    surface=pygame.image.frombuffer(buffer(buf),tuple(size),'RGB')
+    dirname=os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    pygame.image.save(surface,path)
+
+def randomCoefs(rng=None):
+    rand=random if rng is None else rng.random
+    return [rand()*2-1 for i in range(6)]
+
+def musicPalette(musicInfo):
+    # The palette always has 256 entries, whatever the number of slices.
+    hsv=np.empty((256,3))
+    hsv[:,0]=np.asarray(musicInfo)[np.arange(256)*len(musicInfo)//256]
+    hsv[:,1]=0.7
+    hsv[:,2]=0.9
+    return hsv2rgb_array(hsv)
+
+def templateFlame(templatePath):
+    """The template with the constant xforms added, but no coefs or palette."""
+    flame=registry.flame(templatePath)
+    for spec in (xform_const1,xform_const2,xform_const2):
+        flame.add_xform(linear=0,**spec)
     return flame
 
-def addColorElement(flame,index,hue):
-    color=minidom.getDOMImplementation().createDocument(None, 'catalog', None).createElement('color')
-    rgb=""
-    for i in colorsys.hsv_to_rgb(hue,0.7,0.9):
-        rgb+=str(int(i*255))+' '
-    rgb=rgb[:-1]
-    color.setAttribute('rgb',rgb)
-    color.setAttribute('index',str(index))
-    flame.appendChild(color)
+_genomes={}
+def loadGenome(templatePath):
+    """Parses templateFlame into a flam3 genome once per process, and again
+    only if the template file changes."""
+    key=templatePath,registry.stamp(templatePath)
+    if key not in _genomes:
+        for old in [k for k in _genomes if k[0]==templatePath]:
+            flam3_free(_genomes.pop(old))
+        _genomes[key]=Genome.from_string(templateFlame(templatePath).to_string())[0]
+    return _genomes[key][0]
+
+def musicFlame(musicInfo,templatePath,rng=None):
+    """templateFlame with random coefs for the three constant xforms and the
+    music palette, as a Flame. renderMusic renders the same flame without
+    building it."""
+    flame=templateFlame(templatePath)
+    for xform in flame.xform[-3:]:
+        xform.screen_coefs=randomCoefs(rng)
+    flame.gradient.from_array(musicPalette(musicInfo))
     return flame
 
+def renderMusic(musicInfo,templatePath,size,quality,rng=None):
+    """Renders musicFlame without going through xml: a copy of the parsed
+    templateFlame genome is patched in place. The template's own xforms are
+    left as they are."""
+    genome=copy_genome(loadGenome(templatePath))
+    first=len(registry.flame(templatePath).xform)
+    for i in range(3):
+        set_xform(genome[0],first+i,coefs=randomCoefs(rng))
+    set_palette(genome[0],musicPalette(musicInfo))
+    frame=Genome.load_genomes(genome,1)
+    output_buffer,stats=frame.render(size,quality)
+    return output_buffer
+
+def convert(musicPath,imagePath,templatePath=None,size=(640,480),quality=500,
+            sliceNum=256,cache=None,service=None):
+    """Runs the whole music -> flame -> image pipeline without any gui. With
+    a RenderService, the flame is rendered by one of its workers."""
+    if templatePath is None:
+        templatePath=defaultTemplatePath()
+    musicInfo=getMusicInfo(musicPath,sliceNum,cache)
+    rng=Random(getHash(musicInfo))        #
+    if service is None:
+        buf=renderMusic(musicInfo,templatePath,size,quality,rng)
+    else:
+        buf=service.render(musicFlame(musicInfo,templatePath,rng),size,quality,
+                           nthreads=1)
+    saveImage(imagePath,buf,size)
+
+def defaultTemplatePath():
+    parentPath=os.path.dirname(os.path.abspath(sys.argv[0]))
+    return os.path.join(parentPath,'template','template2.flame')
+
+def defaultCache():
+    return AnalysisCache(os.path.join(os.path.expanduser('~'),'.music2picture','cache'))
+
 def getMusicFilePath():
+    import wx
     dialog = wx.FileDialog(None, message="ѡҪת", defaultDir="", 
         defaultFile="", wildcard="Music (*.wav)|*.wav|All files (*.*)|*.*", style=0, 
         pos=wx.DefaultPosition)
@@ -99,6 +144,7 @@ def getMusicFilePath():
     return path
 
 def getImageFilePath():
+    import wx
     dialog = wx.FileDialog(None, message="ѡתͼ񱣴·", defaultDir="", 
         defaultFile="", wildcard="Image (*.jpg)|*.jpg", style=wx.SAVE, 
         pos=wx.DefaultPosition)
@@ -111,40 +157,76 @@ def getImageFilePath():
     dialog.Destroy()
     return path
 
-if __name__ == '__main__':    
+def runGui():
+    import wx
     wxapp=wx.App()
-    parentPath=os.path.split(sys.argv[0])[0]
     musicPath=getMusicFilePath()
     imagePath=getImageFilePath()
     #ж·Ƿ
     if musicPath and imagePath:
-        print "ʼ....."
-        musicInfo=[]
-        soundArray=getAudio(musicPath)[44100:-44100]
-        musicSliceNum=256
-        musicSliceSize=soundArray.size/musicSliceNum
-        for time in range(musicSliceNum):
-            subsoundArray=soundArray[time*musicSliceSize:musicSliceSize+time*musicSliceSize]
-            musicInfo.append(findkey(subsoundArray))
-        musicInfo=[e/2000 for e in musicInfo]
-        seed(getHash(musicInfo))        #
-        print "ɣ"
-
-        
         print "ʼȾͼ....."
-
-        flameDom=minidom.parseString(file(parentPath+"\\template\\template2.flame").read())
-        flame=flameDom.getElementsByTagName('flame')[0]
-
-        flame=addXfromElement(flame,xform_const1)
-        flame=addXfromElement(flame,xform_const2)
-        flame=addXfromElement(flame,xform_const2)
-
-        for i in range(256):
-            flame=addColorElement(flame,i,musicInfo[i])
-        
-        flameDom.replaceChild(flame,flame)
-        xml=flameDom.toprettyxml()[22:]
-        render(xml,500,imagePath)
+        convert(musicPath,imagePath,cache=defaultCache())
         print "Ⱦͼɣ"
 
+def imageExtension(value):
+    """argparse type for --format: accepts 'png' as well as '.png'."""
+    ext=value if value.startswith('.') else '.'+value
+    if len(ext)<2 or os.sep in ext or '.' in ext[1:]:
+        raise argparse.ArgumentTypeError("invalid image extension: %r" % value)
+    return ext
+
+def parseArgs(argv):
+    parser=argparse.ArgumentParser(description="Turn a piece of music into a picture. "
+                                   "Without arguments, file dialogs are shown instead.")
+    parser.add_argument('input',help="wav file to convert (with --batch: a directory "
+                        "or a manifest file listing one track per line)")
+    parser.add_argument('output',help="image file to write (.jpg, .png, .bmp), "
+                        "or the output directory with --batch")
+    parser.add_argument('-t','--template',default=None,
+                        help="flame template (default: template/template2.flame)")
+    parser.add_argument('-s','--size',type=int,nargs=2,default=(640,480),
+                        metavar=('WIDTH','HEIGHT'))
+    parser.add_argument('-q','--quality',type=int,default=500,
+                        help="render quality (sample density)")
+    parser.add_argument('-n','--slices',type=int,default=256,
+                        help="number of slices the music is analysed in")
+    parser.add_argument('--no-cache',action='store_true',
+                        help="don't use the analysis cache")
+    parser.add_argument('-b','--batch',action='store_true',
+                        help="convert every track of a directory or manifest")
+    parser.add_argument('-j','--jobs',type=int,default=None,
+                        help="number of worker processes in batch mode (default: all cores)")
+    parser.add_argument('-f','--format',default='.jpg',type=imageExtension,
+                        help="image extension used in batch mode (jpg, png, bmp)")
+    parser.add_argument('--results',default=None,
+                        help="results manifest written in batch mode "
+                        "(default: OUTPUT/results.jsonl)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    if argv is None:
+        argv=sys.argv[1:]
+    if not argv:
+        runGui()
+        return 0
+    args=parseArgs(argv)
+    if args.batch:
+        from batch import runBatch
+        try:
+            failed=runBatch(args.input,args.output,args.template,args.size,args.quality,
+                            args.slices,not args.no_cache,args.jobs,args.format,args.results)
+        except Exception as e:
+            print >>sys.stderr, "%s: %s" % (args.input, e)
+            return 1
+        return 1 if failed else 0
+    cache=None if args.no_cache else defaultCache()
+    try:
+        convert(args.input,args.output,args.template,args.size,args.quality,
+                args.slices,cache)
+    except Exception as e:
+        print >>sys.stderr, "%s: %s" % (args.input, e)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import os, shutil, tempfile, unittest, wave
+import numpy
+
+from audio import WaveSource
+
+
+class WaveSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.wav')
+        self.samples = numpy.arange(2000, dtype=numpy.int16).reshape(-1, 2)
+        w = wave.open(self.path, 'wb')
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(44100)
+        w.writeframes(self.samples.tostring())
+        w.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def truncate(self, nbytes):
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - nbytes)
+
+    def test_complete(self):
+        source = WaveSource(self.path)
+        self.assertEqual(len(source), 1000)
+        self.assertTrue((source.data == self.samples).all())
+
+    def test_truncated(self):
+        # Cut off 250 frames and a half.
+        self.truncate(1002)
+        source = WaveSource(self.path)
+        self.assertEqual(len(source), 749)
+        self.assertTrue((source.data == self.samples[:749]).all())
+        self.assertEqual(sum(len(b) for b in source.blocks(100)), 749)
+
+    def test_truncated_to_header(self):
+        self.truncate(4000)
+        source = WaveSource(self.path)
+        self.assertEqual(len(source), 0)
+        self.assertEqual(source.data.shape, (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
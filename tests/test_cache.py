@@ -0,0 +1,50 @@
+import os, shutil, tempfile, unittest
+import numpy
+
+import cache
+from cache import AnalysisCache
+
+
+class AnalysisCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = AnalysisCache(self.dir, maxBytes=10000)
+        self.value = numpy.arange(100.0)
+        self.scans = 0
+        self.listdir = os.listdir
+        def listdir(path):
+            self.scans += 1
+            return self.listdir(path)
+        cache.os.listdir = listdir
+
+    def tearDown(self):
+        cache.os.listdir = self.listdir
+        shutil.rmtree(self.dir)
+
+    def entries(self):
+        return [n for n in self.listdir(self.dir) if n.endswith('.npy')]
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.put('a', self.value)
+        self.assertTrue((self.cache.get('a') == self.value).all())
+
+    def test_evict(self):
+        # Each entry takes about 900 bytes.
+        for i in range(30):
+            self.cache.put(str(i), self.value)
+        self.assertTrue(sum(os.path.getsize(os.path.join(self.dir, n))
+                            for n in self.entries()) <= 10000)
+        self.assertTrue('29.npy' in self.entries())
+        self.assertFalse('0.npy' in self.entries())
+        # One scan on the first put, then only when over the limit.
+        self.assertTrue(self.scans < 10, self.scans)
+
+    def test_evicted_meanwhile(self):
+        self.cache.put('a', self.value)
+        os.remove(os.path.join(self.dir, 'a.npy'))
+        self.assertEqual(self.cache.get('a'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
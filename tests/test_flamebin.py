@@ -0,0 +1,47 @@
+import glob, os, unittest
+import xml.etree.cElementTree as etree
+
+from fr0stlib import Flame, split_flamestrings
+
+TEMPLATES = os.path.join(os.path.dirname(__file__), os.pardir, 'template')
+
+
+def elements(string):
+    """to_string output as a list of (tag, attributes, text). Attribute
+    order follows the flame's __dict__, so it's not compared."""
+    return [(e.tag, sorted(e.items()), e.text)
+            for e in etree.fromstring(string).iter()]
+
+
+class RoundTripTest(unittest.TestCase):
+    def test_templates(self):
+        paths = glob.glob(os.path.join(TEMPLATES, '*.flame'))
+        self.assertTrue(paths)
+        for path in paths:
+            with open(path) as f:
+                strings = split_flamestrings(f.read())
+            for string in strings:
+                flame = Flame(string)
+                copy = Flame().from_bytes(flame.to_bytes())
+                self.assertEqual(elements(copy.to_string()),
+                                 elements(flame.to_string()), path)
+
+    def test_types(self):
+        for flame in (Flame(), Flame(split_flamestrings(
+            open(os.path.join(TEMPLATES, 'template1.flame')).read())[0])):
+            self.check_types(flame)
+
+    def check_types(self, flame):
+        flame.enable_de = True
+        flame.passes = 1
+        copy = Flame().from_bytes(flame.to_bytes())
+        for k, v in flame.__dict__.iteritems():
+            if k not in ('xform', 'final', 'gradient'):
+                self.assertEqual(type(copy.__dict__[k]), type(v), k)
+        for x, y in zip(flame.iter_xforms(), copy.iter_xforms()):
+            for k, v in x._iter_scalars():
+                self.assertEqual(type(getattr(y, k)), type(v), k)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os, shutil, tempfile, types, unittest
+
+from fr0stlib import Flame, save_flames, load_flames, iter_flames, \
+     compact_flames
+from fr0stlib.flameindex import FlameIndex, JOURNAL_EXT
+
+
+def make_flame(name):
+    flame = Flame()
+    flame.name = name
+    flame.add_xform()
+    return flame
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.flame')
+        self.flames = [make_flame('f%s' % i) for i in range(3)]
+        save_flames(self.path, *self.flames)
+        self.flames[1].name = 'changed'
+        self.flames.append(make_flame('new'))
+        save_flames(self.path, *self.flames, incremental=True)
+        self.names = ['f0', 'changed', 'f2', 'new']
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_journal(self):
+        self.assertTrue(os.path.exists(self.path + JOURNAL_EXT))
+        self.assertEqual([f.name for f in load_flames(self.path)], self.names)
+
+    def test_iter_strings(self):
+        index = FlameIndex(self.path)
+        strings = index.iter_strings()
+        self.assertTrue(isinstance(strings, types.GeneratorType))
+        self.assertEqual(list(strings), index.strings())
+        self.assertEqual([Flame(s).name for s in index.iter_strings([3, 0])],
+                         ['new', 'f0'])
+        # Closing it early releases the maps.
+        strings = index.iter_strings()
+        next(strings)
+        strings.close()
+
+    def test_iter_flames(self):
+        flames = iter_flames(self.path)
+        self.assertTrue(isinstance(flames, types.GeneratorType))
+        self.assertEqual([f.name for f in flames], self.names)
+        self.assertEqual([f.name for f in iter_flames(
+            self.path, lambda e: e.get('name').startswith('f'))],
+                         ['f0', 'f2'])
+
+    def test_compact(self):
+        compact_flames(self.path)
+        self.assertFalse(os.path.exists(self.path + JOURNAL_EXT))
+        self.assertEqual([f.name for f in load_flames(self.path)], self.names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os, sys, json, shutil, tempfile, unittest, wave
+import numpy
+
+import music2picture
+from batch import runBatch
+from fr0stlib.render import render_funcs
+
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+
+class ParseArgsTest(unittest.TestCase):
+    def format(self, *argv):
+        return music2picture.parseArgs(list(argv) + ['in', 'out']).format
+
+    def test_format(self):
+        self.assertEqual(self.format(), '.jpg')
+        self.assertEqual(self.format('-f', 'png'), '.png')
+        self.assertEqual(self.format('--format', '.bmp'), '.bmp')
+
+    def test_bad_format(self):
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            for value in ('', '.', 'a/b', 'tar.gz'):
+                self.assertRaises(SystemExit, self.format, '-f', value)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+
+
+
+def _crash(*args, **kwds):
+    os._exit(1)
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.input = os.path.join(self.dir, 'in')
+        self.output = os.path.join(self.dir, 'out')
+        os.mkdir(self.input)
+        with open(os.path.join(self.input, 'bad.wav'), 'w') as f:
+            f.write('junk')
+        w = wave.open(os.path.join(self.input, 'good.wav'), 'wb')
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(44100)
+        t = numpy.arange(44100 * 6)
+        w.writeframes((numpy.sin(t * 0.05) * 10000).astype(numpy.int16)
+                      .tostring())
+        w.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        render_funcs.pop('crash', None)
+
+    def run_batch(self, **kwds):
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            failed = runBatch(self.input, self.output, processes=2,
+                              useCache=False, size=(40, 30), quality=2,
+                              sliceNum=16, **kwds)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        with open(os.path.join(self.output, 'results.jsonl')) as f:
+            results = [json.loads(line) for line in f]
+        return failed, dict((os.path.basename(r['input']), r) for r in results)
+
+    def test_bad_template(self):
+        self.assertRaises(EnvironmentError, runBatch, self.input, self.output,
+                          os.path.join(self.dir, 'missing.flame'))
+
+    @unittest.skipIf(pygame is None, "pygame is needed to save images")
+    def test_batch(self):
+        failed, results = self.run_batch(renderer='numpy')
+        self.assertEqual(failed, 1)
+        self.assertEqual(results['bad.wav']['status'], 'failed')
+        self.assertEqual(results['good.wav']['status'], 'ok')
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'good.jpg')))
+
+    @unittest.skipIf(os.name == 'nt', "render workers must be forked")
+    def test_crashing_renderer(self):
+        render_funcs['crash'] = _crash
+        failed, results = self.run_batch(renderer='crash')
+        self.assertEqual(failed, 2)
+        self.assertTrue('WorkerCrashed' in results['good.wav']['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
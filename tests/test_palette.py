@@ -0,0 +1,159 @@
+import unittest
+
+import numpy
+
+from fr0stlib import (Palette, rgb2hls, hls2rgb, rgb2hsv, hsv2rgb,
+                      rgb2hls_array, hls2rgb_array, rgb2hsv_array,
+                      hsv2rgb_array, pblend_color, gradients_from_seeds,
+                      random_gradients)
+
+
+def _colors(rand, n=5000):
+    """n random rgb colors, with a share of grays and saturated colors."""
+    colors = rand.randint(0, 256, (n, 3))
+    colors[:n//10] = colors[:n//10, :1]
+    colors[n//10:n//5, rand.randint(3)] = 0
+    colors[n//10:n//5, rand.randint(3)] = 255
+    return colors
+
+
+class ConversionTest(unittest.TestCase):
+    """The array converters against the colorsys based ones."""
+
+    def setUp(self):
+        self.rand = numpy.random.RandomState(11)
+        self.rgb = _colors(self.rand)
+
+    def test_rgb2hls(self):
+        expected = [rgb2hls(c) for c in self.rgb]
+        numpy.testing.assert_allclose(rgb2hls_array(self.rgb), expected,
+                                      atol=1e-12)
+
+    def test_rgb2hsv(self):
+        expected = [rgb2hsv(c) for c in self.rgb]
+        numpy.testing.assert_allclose(rgb2hsv_array(self.rgb), expected,
+                                      atol=1e-12)
+
+    def test_hls2rgb(self):
+        hls = self.rand.uniform(0, 1, (5000, 3))
+        hls[:500, 2] = 0
+        expected = [hls2rgb(c) for c in hls]
+        numpy.testing.assert_array_equal(hls2rgb_array(hls), expected)
+
+    def test_hsv2rgb(self):
+        hsv = self.rand.uniform(0, 1, (5000, 3))
+        hsv[:500, 1] = 0
+        expected = [hsv2rgb(c) for c in hsv]
+        numpy.testing.assert_array_equal(hsv2rgb_array(hsv), expected)
+
+    def test_round_trip(self):
+        numpy.testing.assert_array_equal(
+            hls2rgb_array(rgb2hls_array(self.rgb)),
+            [hls2rgb(rgb2hls(c)) for c in self.rgb])
+        numpy.testing.assert_array_equal(
+            hsv2rgb_array(rgb2hsv_array(self.rgb)),
+            [hsv2rgb(rgb2hsv(c)) for c in self.rgb])
+
+    def test_shape(self):
+        rgb = self.rgb[:256].reshape(16, 16, 3)
+        self.assertEqual(rgb2hls_array(rgb).shape, (16, 16, 3))
+        self.assertEqual(hsv2rgb_array(rgb2hsv_array(rgb)).dtype,
+                         numpy.uint8)
+
+
+class PaletteAdjustTest(unittest.TestCase):
+    """hue, saturation and brightness against the old per-color loops."""
+
+    def setUp(self):
+        self.palette = Palette()
+        self.palette.data = numpy.array(
+            _colors(numpy.random.RandomState(12), 256), dtype=numpy.uint8)
+
+    def adjust(self, index, value):
+        data = []
+        for color in self.palette.data:
+            hls = list(rgb2hls(color))
+            if index == 0:
+                hls[0] = (hls[0] + value) % 1
+            else:
+                hls[index] = max(0, min(1, hls[index] + value))
+            data.append(hls2rgb(hls))
+        return data
+
+    def test_hue(self):
+        for value in (-400, -90, 0, 37.5, 180, 720):
+            expected = self.adjust(0, value/360.0)
+            self.palette.hue(value)
+            numpy.testing.assert_array_equal(self.palette.data, expected)
+
+    def test_saturation(self):
+        for value in (-150, -30, 0, 12.5, 50):
+            expected = self.adjust(2, value/100.0)
+            self.palette.saturation(value)
+            numpy.testing.assert_array_equal(self.palette.data, expected)
+
+    def test_brightness(self):
+        for value in (-150, -30, 0, 12.5, 50):
+            expected = self.adjust(1, value/100.0)
+            self.palette.brightness(value)
+            numpy.testing.assert_array_equal(self.palette.data, expected)
+
+
+def _from_seeds(seeds, curve):
+    """The per-entry loop Palette.from_seeds used before gradients_from_seeds."""
+    ns = len(seeds)
+    d = 256/ns
+    r = 256%ns
+    gen = []
+    for i in xrange(ns):
+        ds = d + (i < r)
+        start, end = seeds[i-1], seeds[i]
+        for j in xrange(ds):
+            hsv = pblend_color(start, end, j/float(ds), curve)
+            gen.append(hsv2rgb(hsv))
+    return gen
+
+
+class GradientTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = numpy.random.RandomState(12)
+
+    def test_from_seeds(self):
+        for curve in ('linear', 'cos', 'cubic'):
+            for n in xrange(300):
+                seeds = self.rand.uniform(0, 1, (self.rand.randint(2, 40), 3))
+                expected = _from_seeds(seeds.tolist(), curve)
+                palette = Palette()
+                palette.from_seeds(seeds.tolist(), curve)
+                numpy.testing.assert_array_equal(palette.data, expected)
+
+    def test_batch(self):
+        seeds = self.rand.uniform(0, 1, (300, 7, 3))
+        result = gradients_from_seeds(seeds, 'cubic')
+        self.assertEqual(result.shape, (300, 256, 3))
+        self.assertEqual(result.dtype, numpy.uint8)
+        for palette, s in zip(result, seeds):
+            numpy.testing.assert_array_equal(palette,
+                                             _from_seeds(s.tolist(), 'cubic'))
+
+    def test_invalid_curve(self):
+        self.assertRaises(ValueError, gradients_from_seeds,
+                          [[(0, 0, 0), (1, 1, 1)]], 'spline')
+
+    def test_random_gradients(self):
+        result = random_gradients(50, hue=(0.9, 0.1), nodes=(2, 9),
+                                  rand=self.rand)
+        self.assertEqual(result.shape, (50, 256, 3))
+        # Hues stay in the wrapped range, give or take the rounding to ints.
+        hsv = rgb2hsv_array(result)
+        hue = hsv[..., 0][(hsv[..., 1] > 0.3) & (hsv[..., 2] > 0.3)]
+        self.assertTrue(((hue >= 0.85) | (hue <= 0.15)).all())
+
+    def test_random_gradients_seeded(self):
+        a = random_gradients(20, rand=numpy.random.RandomState(5))
+        b = random_gradients(20, rand=numpy.random.RandomState(5))
+        numpy.testing.assert_array_equal(a, b)
+
+
+if __name__ == '__main__':
+    unittest.main()
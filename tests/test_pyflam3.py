@@ -0,0 +1,170 @@
+import threading, time, unittest
+
+from fr0stlib import Flame
+from fr0stlib import pyflam3
+from fr0stlib.pyflam3 import Genome, GenomeCache, flam3_available, \
+     flam3_free, flam3_print_to_string, xform_size, get_xform, set_xform, \
+     set_palette
+
+from test_render_output import _flame
+
+
+def printed(genomes):
+    return flam3_print_to_string(genomes[0])
+
+
+@unittest.skipIf(not flam3_available, "libflam3 is not available")
+class PatchGenomeTest(unittest.TestCase):
+    coefs = (0.5, -0.25, 0.125, 0.75, -0.375, 0.0625)
+    post = (1.0, 0.5, 0.0, 1.0, 0.25, -0.5)
+
+    def test_xform_size(self):
+        size = xform_size()
+        self.assertTrue(size >= pyflam3.sizeof(pyflam3.XFormHead))
+        self.assertEqual(size % pyflam3.sizeof(pyflam3.c_double), 0)
+
+    def test_get_xform(self):
+        flame = Flame(_flame)
+        genomes, ngenomes = Genome.from_string(flame.to_string())
+        try:
+            for i, x in enumerate(flame.xform):
+                xf = get_xform(genomes[0], i)
+                self.assertEqual(xf.density, x.weight)
+                self.assertEqual(xf.color, x.color)
+                self.assertEqual(pyflam3._flat(xf.c), tuple(x.screen_coefs))
+            self.assertRaises(IndexError, get_xform, genomes[0], 3)
+        finally:
+            flam3_free(genomes)
+
+    def test_patch_matches_flame(self):
+        flame = Flame(_flame)
+        palette = [(i, (i * 7) % 256, 255 - i) for i in range(256)]
+        genomes, ngenomes = Genome.from_string(flame.to_string())
+        try:
+            set_xform(genomes[0], 1, coefs=self.coefs, post=self.post,
+                      weight=0.25, color=0.75, linear=0.5, spherical=0.25)
+            set_palette(genomes[0], palette)
+            patched = printed(genomes)
+        finally:
+            flam3_free(genomes)
+
+        x = flame.xform[1]
+        x.screen_coefs = self.coefs
+        x.post.screen_coefs = self.post
+        x.weight = 0.25
+        x.color = 0.75
+        x.linear = 0.5
+        x.spherical = 0.25
+        flame.gradient.from_array(palette)
+        genomes, ngenomes = Genome.from_string(flame.to_string())
+        try:
+            self.assertEqual(patched, printed(genomes))
+        finally:
+            flam3_free(genomes)
+
+
+
+class _StubGenome(object):
+    """Stands in for Genome in pyflam3, so GenomeCache can be tested
+    without libflam3. Parsed "genomes" are lists holding the string."""
+    parsed = []
+
+    @classmethod
+    def from_string(cls, string):
+        cls.parsed.append(string)
+        time.sleep(0.01)
+        if 'bad' in string:
+            return None, 0
+        return [string], 1
+
+
+class GenomeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = pyflam3.Genome, pyflam3.copy_genomes, pyflam3.flam3_free
+        self.freed = []
+        _StubGenome.parsed = []
+        pyflam3.Genome = _StubGenome
+        pyflam3.copy_genomes = lambda genomes, n: list(genomes)
+        pyflam3.flam3_free = self.freed.append
+        self.cache = GenomeCache(maxsize=2)
+
+    def tearDown(self):
+        pyflam3.Genome, pyflam3.copy_genomes, pyflam3.flam3_free = self.saved
+
+    def test_copies(self):
+        first, n = self.cache.get('a')
+        self.assertEqual((first, n), (['a'], 1))
+        first.append('changed')
+        second, n = self.cache.get('a')
+        self.assertEqual(second, ['a'])
+        self.assertFalse(first is second)
+        self.assertEqual(_StubGenome.parsed, ['a'])
+
+    def test_key(self):
+        self.cache.get('<flame>\r\n</flame>\n')
+        self.cache.get('  <flame>\n</flame>')
+        self.assertEqual(len(_StubGenome.parsed), 1)
+
+    def test_lru(self):
+        a = self.cache.get('a')[0]
+        self.cache.get('b')
+        self.cache.get('a')
+        # b is the least recently used one now.
+        self.cache.get('c')
+        self.assertEqual(self.freed, [['b']])
+        self.cache.get('a')
+        self.assertEqual(_StubGenome.parsed, ['a', 'b', 'c'])
+        self.cache.get('b')
+        self.assertEqual(self.freed, [['b'], ['c']])
+        # Copies handed out are never freed by the cache.
+        self.assertFalse(any(f is a for f in self.freed))
+
+    def test_failed_parse(self):
+        self.assertEqual(self.cache.get('bad'), (None, 0))
+        self.cache.get('bad')
+        self.assertEqual(_StubGenome.parsed, ['bad', 'bad'])
+        self.assertEqual(self.freed, [])
+
+    def test_clear(self):
+        self.cache.get('a')
+        self.cache.get('b')
+        self.cache.clear()
+        self.assertEqual(sorted(self.freed), [['a'], ['b']])
+        self.cache.get('a')
+        self.assertEqual(_StubGenome.parsed, ['a', 'b', 'a'])
+
+    def test_threads(self):
+        results = []
+        def get():
+            results.append(self.cache.get('a')[0])
+        threads = [threading.Thread(target=get) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(_StubGenome.parsed, ['a'])
+        self.assertEqual(results, [['a']] * 8)
+        self.assertEqual(len(set(map(id, results))), 8)
+
+
+@unittest.skipIf(not flam3_available, "libflam3 is not available")
+class GenomeCacheFlam3Test(unittest.TestCase):
+    def test_copies(self):
+        cache = GenomeCache(maxsize=1)
+        string = Flame(_flame).to_string()
+        genomes, n = cache.get(string)
+        expected = printed(genomes)
+        genomes[0].width = 7
+        flam3_free(genomes)
+        again, n = cache.get(string)
+        self.assertEqual(printed(again), expected)
+        flam3_free(again)
+        # Evicts and frees the first entry.
+        other = Flame(_flame)
+        other.xform[0].weight = 0.5
+        flam3_free(cache.get(other.to_string())[0])
+        cache.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
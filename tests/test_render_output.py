@@ -0,0 +1,117 @@
+import gc, unittest
+import numpy
+
+from fr0stlib import Flame
+from fr0stlib.render import numpy_render
+from fr0stlib.chaosgame import iterate, iterate_parallel, BATCH_SIZE
+
+_flame = """<flame name="sierpinski" version="fr0st 1.0" size="40 30" center="0.5 0.4" scale="40">
+<xform weight="1" color="0" linear="1" coefs="0.5 0 0 0.5 0 0"/>
+<xform weight="1" color="0.5" linear="1" coefs="0.5 0 0 0.5 0.5 0"/>
+<xform weight="1" color="1" linear="1" coefs="0.5 0 0 0.5 0.25 0.5"/>
+<palette count="256" format="RGB">%s</palette>
+</flame>""" % ''.join('%02X%02X80' % (i, 255-i) for i in range(256))
+
+
+class OutputBufferTest(unittest.TestCase):
+    size = 40, 30
+
+    # With several processes the sums in the histogram come out in a
+    # different order every time, so compare single process renders.
+    def setUp(self):
+        self.flame = Flame(_flame)
+        self.expected = numpy_render(self.flame, self.size, 2, seed=1,
+                                     nthreads=1, array=True).copy()
+
+    def render(self, **kwds):
+        return numpy_render(self.flame, self.size, 2, seed=1, nthreads=1,
+                            **kwds)
+
+    def churn(self):
+        # Reuse freed memory, so a dangling view would show garbage.
+        gc.collect()
+        junk = [numpy.ones((30, 40, 3), numpy.uint8) for i in range(20)]
+
+    def test_array_is_view_of_out(self):
+        out = numpy.zeros((30, 40, 3), numpy.uint8)
+        result = self.render(out=out, array=True)
+        self.assertTrue(numpy.may_share_memory(result, out))
+        self.assertTrue((out == self.expected).all())
+
+    def test_temporary_out_array(self):
+        result = self.render(out=numpy.empty((30, 40, 3), numpy.uint8),
+                             array=True)
+        self.churn()
+        self.assertTrue((result == self.expected).all())
+
+    def test_temporary_out_buffer(self):
+        result = self.render(out=numpy.empty(30 * 40 * 3, numpy.uint8))
+        self.churn()
+        self.assertEqual(bytearray(result), bytearray(self.expected.tostring()))
+
+    def test_bad_out(self):
+        self.assertRaises(ValueError, self.render,
+                          out=numpy.empty(10, numpy.uint8))
+        self.assertRaises(ValueError, self.render,
+                          out=numpy.empty((30, 40, 3)))
+
+
+
+class ParallelTest(unittest.TestCase):
+    size = 40, 30
+
+    def setUp(self):
+        self.flame = Flame(_flame)
+
+    def test_histogram(self):
+        histogram, iterations, badvals = iterate_parallel(self.flame,
+                                                          self.size, 4, 2, 1)
+        single, game = iterate(self.flame, self.size, 4, 1)
+        self.assertEqual(histogram.shape, single.shape)
+        self.assertEqual(iterations, 2 * game.iterations)
+        # Every plotted point adds 255 to the density, so the density per
+        # iteration is the same.
+        self.assertAlmostEqual(histogram[:,3].sum() / iterations,
+                               single[:,3].sum() / game.iterations, -1)
+
+    def test_batch_rounding(self):
+        # Both qualities run exactly one batch, which gives the same image.
+        npixels = self.size[0] * self.size[1]
+        full = BATCH_SIZE / float(npixels)
+        low = numpy_render(self.flame, self.size, 2, seed=1, nthreads=1,
+                           array=True)
+        high = numpy_render(self.flame, self.size, full, seed=1, nthreads=1,
+                            array=True)
+        self.assertTrue((low == high).all())
+
+    def test_single_matches_parallel(self):
+        # The parallel render plots twice the points, as every process
+        # runs a whole batch, but shouldn't come out brighter for it.
+        diff = 0
+        for seed in range(3):
+            single = numpy_render(self.flame, self.size, 2, seed=seed,
+                                  nthreads=1, array=True)
+            parallel = numpy_render(self.flame, self.size, 2, seed=seed,
+                                    nthreads=2, array=True)
+            diff += parallel.mean() - single.mean()
+        self.assertTrue(abs(diff / 3) < 1.25, diff / 3)
+
+    def test_nthreads(self):
+        result = numpy_render(self.flame, self.size, 2, nthreads=2, array=True)
+        self.assertEqual(result.shape, (30, 40, 3))
+        self.assertTrue(result.any())
+
+    def test_worker_exception(self):
+        self.flame.xform[0].linear = 0
+        self.flame.xform[0].bipolar = 1
+        try:
+            numpy_render(self.flame, self.size, 2, nthreads=2)
+        except NotImplementedError as e:
+            self.assertTrue('bipolar' in str(e))
+            self.assertTrue('Traceback' in str(e))
+        else:
+            self.fail("NotImplementedError not raised")
+
+
+if __name__ == '__main__':
+    unittest.main()
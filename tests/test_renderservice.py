@@ -0,0 +1,78 @@
+import unittest
+
+from fr0stlib import Flame
+from fr0stlib import renderservice
+from fr0stlib.renderservice import RenderService, RenderError, WorkerCrashed
+from fr0stlib.render import numpy_render
+
+from test_render_output import _flame
+
+
+class RenderServiceTest(unittest.TestCase):
+    size = 40, 30
+
+    def setUp(self):
+        self.service = RenderService(1, 'numpy', size=self.size)
+
+    def tearDown(self):
+        self.service.close()
+
+    def render(self, flame=_flame):
+        return self.service.render(flame, self.size, 2, seed=1, nthreads=1,
+                                   array=True)
+
+    def kill_worker(self):
+        worker = self.service._idle.get()
+        worker.process.terminate()
+        worker.process.join()
+        self.service._idle.put(worker)
+
+    def test_render(self):
+        expected = numpy_render(_flame, self.size, 2, seed=1, nthreads=1,
+                                array=True)
+        self.assertTrue((self.render() == expected).all())
+
+    def test_crash(self):
+        self.kill_worker()
+        self.assertRaises(WorkerCrashed, self.render)
+        self.assertTrue(self.render().any())
+
+    def test_failed_replacement(self):
+        def fail(*args):
+            raise OSError("Can't start process")
+        self.kill_worker()
+        Worker = renderservice._Worker
+        renderservice._Worker = fail
+        try:
+            self.assertRaises(WorkerCrashed, self.render)
+            self.assertRaises(WorkerCrashed, self.render)
+            results = self.service.map([_flame], self.size, 2)
+            self.assertTrue(isinstance(results[0], WorkerCrashed))
+        finally:
+            renderservice._Worker = Worker
+        # The slot wasn't lost, so the pool works and closes again.
+        self.assertTrue(self.render().any())
+
+    def test_failed_resize(self):
+        def fail(*args):
+            raise OSError("Can't start process")
+        Worker = renderservice._Worker
+        renderservice._Worker = fail
+        try:
+            # Too big for the worker, which is stopped for a bigger one.
+            self.assertRaises(WorkerCrashed, self.service.render, _flame,
+                              (80, 60), 2, nthreads=1)
+        finally:
+            renderservice._Worker = Worker
+        self.assertTrue(self.render().any())
+
+    def test_map(self):
+        bad = Flame(_flame)
+        bad.xform[0].bipolar = 1
+        results = self.service.map([_flame, bad], self.size, 2)
+        self.assertFalse(isinstance(results[0], RenderError))
+        self.assertTrue(isinstance(results[1], RenderError))
+
+
+if __name__ == '__main__':
+    unittest.main()
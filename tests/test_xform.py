@@ -0,0 +1,41 @@
+import unittest
+
+from fr0stlib import Flame
+
+
+class XformAttributeTest(unittest.TestCase):
+    def setUp(self):
+        self.flame = Flame()
+        self.xform = self.flame.add_xform(weight=0.5)
+
+    def test_no_dict(self):
+        self.assertFalse(hasattr(self.xform, '__dict__'))
+        self.assertFalse(hasattr(self.xform.post, '__dict__'))
+
+    def test_defaults(self):
+        x = self.xform
+        self.assertEqual(x.opacity, 1.0)
+        self.assertEqual(x.spherical, 0.0)
+        self.assertFalse(hasattr(x, 'symmetry'))
+        self.assertFalse(hasattr(x, 'blob_low'))
+        self.assertEqual(self.flame.add_final().weight, 0.0)
+
+    def test_unknown_attributes(self):
+        x = self.xform
+        x.var_color = 0.25
+        for flame in (Flame(self.flame.to_string()), self.flame.copy(),
+                      Flame().from_bytes(self.flame.to_bytes())):
+            y = flame.xform[0]
+            self.assertEqual(y.var_color, 0.25)
+            self.assertEqual(y.weight, 0.5)
+        del x.var_color
+        self.assertFalse(hasattr(x, 'var_color'))
+        self.assertRaises(AttributeError, delattr, x, 'var_color')
+
+    def test_post(self):
+        self.assertRaises(AttributeError, setattr, self.xform.post,
+                          'weight', 1)
+
+
+if __name__ == '__main__':
+    unittest.main()